@@ -4,11 +4,26 @@ import uuid
 import time
 import hashlib
 import json
+import operator
+import shutil
+import sqlite3
+from collections import Counter, OrderedDict, deque
 from datetime import datetime
-# import threading  # Removed: not used
+import threading
+import queue
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 import cv2
 import numpy as np
 
+from frame_ring import FrameRangeCapture, SharedFrameRing, decode_into_ring
+
+try:
+    import fcntl
+except ImportError:  # Windows: single-process development server only
+    fcntl = None
+
 # Try to import mediapipe, with fallback
 try:
     import mediapipe as mp
@@ -27,39 +42,477 @@ app.config['UPLOAD_FOLDER'] = os.path.join(os.getcwd(), 'static', 'uploads')
 app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY', 'your-secret-key-change-in-production')
 os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
 
-# User data storage (in production, use a proper database)
+# User data storage: accounts and their session summaries live in SQLite.
+# USERS_FILE is only read to import existing accounts into a new database.
 USERS_FILE = 'users.json'
+USERS_DB = os.environ.get('USERS_DB', 'users.db')
 QUESTIONS_FILE = 'questions.json'
 
-def load_users():
-    """Load users from JSON file"""
-    if os.path.exists(USERS_FILE):
+USER_FIELDS = ('id', 'name', 'email', 'password', 'user_type', 'created_at', 'profile_picture')
+USER_SESSION_FIELDS = ('session_id', 'exercise', 'total_reps', 'duration_s', 'created_at')
+
+_db_local = threading.local()
+
+USER_SCHEMA = (
+    '''
+    CREATE TABLE IF NOT EXISTS users (
+        id TEXT PRIMARY KEY,
+        name TEXT NOT NULL,
+        email TEXT NOT NULL,
+        password TEXT NOT NULL,
+        user_type TEXT NOT NULL,
+        created_at TEXT NOT NULL,
+        profile_picture TEXT
+    )
+    ''',
+    'CREATE UNIQUE INDEX IF NOT EXISTS idx_users_email ON users (email)',
+    '''
+    CREATE TABLE IF NOT EXISTS user_sessions (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id TEXT NOT NULL REFERENCES users (id) ON DELETE CASCADE,
+        session_id TEXT,
+        exercise TEXT,
+        total_reps INTEGER NOT NULL DEFAULT 0,
+        duration_s REAL NOT NULL DEFAULT 0,
+        created_at TEXT
+    )
+    ''',
+    'CREATE INDEX IF NOT EXISTS idx_user_sessions_user ON user_sessions (user_id, id)',
+    '''
+    CREATE TABLE IF NOT EXISTS user_stats (
+        user_id TEXT PRIMARY KEY REFERENCES users (id) ON DELETE CASCADE,
+        total_sessions INTEGER NOT NULL DEFAULT 0,
+        total_reps INTEGER NOT NULL DEFAULT 0,
+        total_duration_s REAL NOT NULL DEFAULT 0,
+        best_reps INTEGER NOT NULL DEFAULT 0,
+        best_session_id TEXT,
+        current_streak INTEGER NOT NULL DEFAULT 0,
+        longest_streak INTEGER NOT NULL DEFAULT 0,
+        last_active TEXT
+    )
+    ''',
+    '''
+    CREATE TABLE IF NOT EXISTS user_exercise_stats (
+        user_id TEXT NOT NULL REFERENCES users (id) ON DELETE CASCADE,
+        exercise TEXT NOT NULL,
+        sessions INTEGER NOT NULL DEFAULT 0,
+        total_reps INTEGER NOT NULL DEFAULT 0,
+        total_duration_s REAL NOT NULL DEFAULT 0,
+        best_reps INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (user_id, exercise)
+    )
+    ''',
+    '''
+    CREATE TABLE IF NOT EXISTS user_weekly_stats (
+        user_id TEXT NOT NULL REFERENCES users (id) ON DELETE CASCADE,
+        week TEXT NOT NULL,
+        sessions INTEGER NOT NULL DEFAULT 0,
+        total_reps INTEGER NOT NULL DEFAULT 0,
+        total_duration_s REAL NOT NULL DEFAULT 0,
+        PRIMARY KEY (user_id, week)
+    )
+    ''',
+    '''
+    CREATE TABLE IF NOT EXISTS analysis_sessions (
+        id TEXT PRIMARY KEY,
+        data TEXT NOT NULL,
+        finished_at REAL NOT NULL
+    )
+    ''',
+    '''
+    CREATE TABLE IF NOT EXISTS uploads (
+        id TEXT PRIMARY KEY,
+        user_id TEXT NOT NULL,
+        path TEXT NOT NULL,
+        size INTEGER NOT NULL,
+        exercise TEXT NOT NULL,
+        options TEXT NOT NULL,
+        session_id TEXT,
+        updated_at REAL NOT NULL
+    )
+    ''',
+)
+
+
+def get_db() -> sqlite3.Connection:
+    """This thread's connection to the users database (opened once per thread)"""
+    conn = getattr(_db_local, 'conn', None)
+    if conn is None:
+        conn = sqlite3.connect(USERS_DB, timeout=30, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        conn.execute('PRAGMA foreign_keys=ON')
+        _db_local.conn = conn
+    return conn
+
+
+def init_user_db():
+    """Create the users tables, importing users.json the first time"""
+    conn = get_db()
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        for statement in USER_SCHEMA:
+            conn.execute(statement)
+        if conn.execute('PRAGMA user_version').fetchone()[0] == 0:
+            if os.path.exists(USERS_FILE):
+                try:
+                    with open(USERS_FILE, 'r') as f:
+                        _write_users(conn, json.load(f))
+                    print(f"Imported {USERS_FILE} into {USERS_DB}")
+                except (OSError, ValueError) as e:
+                    print(f"Could not import {USERS_FILE}: {e}")
+            conn.execute('PRAGMA user_version = 2')
+        elif conn.execute('PRAGMA user_version').fetchone()[0] == 1:
+            # the per-user rollups were added in version 2: build them from the sessions
+            for row in conn.execute('SELECT id FROM users').fetchall():
+                _rebuild_user_stats(conn, row['id'])
+            conn.execute('PRAGMA user_version = 2')
+        conn.execute('COMMIT')
+    except Exception:
+        conn.execute('ROLLBACK')
+        raise
+
+
+def _write_users(conn: sqlite3.Connection, users: dict):
+    for email, user in users.items():
+        row = dict(user, email=user.get('email') or email)
+        conn.execute(f"INSERT OR REPLACE INTO users ({', '.join(USER_FIELDS)}) VALUES ({', '.join('?' * len(USER_FIELDS))})",
+                     [row.get(field) for field in USER_FIELDS])
+        conn.execute('DELETE FROM user_sessions WHERE user_id = ?', (row['id'],))
+        conn.executemany(
+            f"INSERT INTO user_sessions (user_id, {', '.join(USER_SESSION_FIELDS)}) VALUES (?, {', '.join('?' * len(USER_SESSION_FIELDS))})",
+            [[row['id']] + [item.get(field) for field in USER_SESSION_FIELDS] for item in user.get('sessions', [])])
+        _rebuild_user_stats(conn, row['id'])
+
+
+def _session_day(summary: dict):
+    try:
+        return datetime.fromisoformat(summary.get('created_at')).date()
+    except (TypeError, ValueError):
+        return datetime.now().date()
+
+
+# Rollups of a user with no sessions yet
+EMPTY_USER_STATS = {'total_sessions': 0, 'total_reps': 0, 'total_duration_s': 0.0, 'best_reps': 0,
+                    'best_session_id': None, 'current_streak': 0, 'longest_streak': 0, 'last_active': None}
+
+
+def _update_user_stats(conn: sqlite3.Connection, user_id: str, summary: dict):
+    """Fold one finished session into a user's rollups (totals, bests, streak, per exercise and per week)"""
+    reps = int(summary.get('total_reps') or 0)
+    duration = float(summary.get('duration_s') or 0)
+    day = _session_day(summary)
+    year, week, _ = day.isocalendar()
+
+    row = conn.execute('SELECT * FROM user_stats WHERE user_id = ?', (user_id,)).fetchone()
+    stats = dict(row) if row else dict(EMPTY_USER_STATS)
+    last = datetime.fromisoformat(stats['last_active']).date() if stats['last_active'] else None
+    if last is None or (day - last).days > 1:
+        stats['current_streak'] = 1
+    elif (day - last).days == 1:
+        stats['current_streak'] += 1
+    if last is None or day > last:
+        stats['last_active'] = day.isoformat()
+    stats['longest_streak'] = max(stats['longest_streak'], stats['current_streak'])
+    if stats['total_sessions'] == 0 or reps > stats['best_reps']:
+        stats['best_reps'] = reps
+        stats['best_session_id'] = summary.get('session_id')
+    stats['total_sessions'] += 1
+    stats['total_reps'] += reps
+    stats['total_duration_s'] += duration
+    stats['user_id'] = user_id
+    conn.execute(f"INSERT OR REPLACE INTO user_stats ({', '.join(stats)}) VALUES ({', '.join('?' * len(stats))})",
+                 list(stats.values()))
+
+    conn.execute('''
+        INSERT INTO user_exercise_stats (user_id, exercise, sessions, total_reps, total_duration_s, best_reps)
+        VALUES (?, ?, 1, ?, ?, ?)
+        ON CONFLICT (user_id, exercise) DO UPDATE SET
+            sessions = sessions + 1,
+            total_reps = total_reps + excluded.total_reps,
+            total_duration_s = total_duration_s + excluded.total_duration_s,
+            best_reps = MAX(best_reps, excluded.best_reps)
+    ''', (user_id, summary.get('exercise') or 'pushup', reps, duration, reps))
+    conn.execute('''
+        INSERT INTO user_weekly_stats (user_id, week, sessions, total_reps, total_duration_s)
+        VALUES (?, ?, 1, ?, ?)
+        ON CONFLICT (user_id, week) DO UPDATE SET
+            sessions = sessions + 1,
+            total_reps = total_reps + excluded.total_reps,
+            total_duration_s = total_duration_s + excluded.total_duration_s
+    ''', (user_id, f'{year}-W{week:02d}', reps, duration))
+
+
+def _rebuild_user_stats(conn: sqlite3.Connection, user_id: str):
+    """Recompute a user's rollups from all of their sessions"""
+    for table in ('user_stats', 'user_exercise_stats', 'user_weekly_stats'):
+        conn.execute(f'DELETE FROM {table} WHERE user_id = ?', (user_id,))
+    rows = conn.execute(f"SELECT {', '.join(USER_SESSION_FIELDS)} FROM user_sessions WHERE user_id = ? ORDER BY id",
+                        (user_id,)).fetchall()
+    for row in rows:
+        _update_user_stats(conn, user_id, dict(row))
+
+
+def get_user(user_id: str) -> dict | None:
+    row = get_db().execute('SELECT * FROM users WHERE id = ?', (user_id,)).fetchone()
+    return dict(row) if row else None
+
+
+def get_user_by_email(email: str) -> dict | None:
+    row = get_db().execute('SELECT * FROM users WHERE email = ?', (email,)).fetchone()
+    return dict(row) if row else None
+
+
+def add_user_session(user_id: str, summary: dict) -> bool:
+    """Append one session summary to a user's history and rollups; False if there is no such user"""
+    conn = get_db()
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        conn.execute(
+            f"INSERT INTO user_sessions (user_id, {', '.join(USER_SESSION_FIELDS)}) VALUES (?, {', '.join('?' * len(USER_SESSION_FIELDS))})",
+            [user_id] + [summary.get(field) for field in USER_SESSION_FIELDS])
+        _update_user_stats(conn, user_id, summary)
+        conn.execute('COMMIT')
+    except sqlite3.IntegrityError:
+        conn.execute('ROLLBACK')
+        return False
+    except Exception:
+        conn.execute('ROLLBACK')
+        raise
+    return True
+
+
+def get_user_stats(user_id: str, weeks: int = 8) -> dict:
+    """A user's rollups: totals, best session, streaks, per-exercise totals and the most recent ``weeks`` active weeks"""
+    conn = get_db()
+    row = conn.execute('SELECT * FROM user_stats WHERE user_id = ?', (user_id,)).fetchone()
+    stats = dict(row) if row else dict(EMPTY_USER_STATS)
+    stats.pop('user_id', None)
+    if stats['last_active'] and (datetime.now().date() - datetime.fromisoformat(stats['last_active']).date()).days > 1:
+        stats['current_streak'] = 0  # the streak was broken since the last session
+    stats['exercises'] = {
+        r['exercise']: {k: r[k] for k in ('sessions', 'total_reps', 'total_duration_s', 'best_reps')}
+        for r in conn.execute('SELECT * FROM user_exercise_stats WHERE user_id = ? ORDER BY exercise', (user_id,))
+    }
+    stats['weekly'] = [
+        {k: r[k] for k in ('week', 'sessions', 'total_reps', 'total_duration_s')}
+        for r in reversed(conn.execute('SELECT * FROM user_weekly_stats WHERE user_id = ? ORDER BY week DESC LIMIT ?',
+                                       (user_id, weeks)).fetchall())
+    ]
+    return stats
+
+
+def create_user(user: dict) -> bool:
+    """Insert a new account; False if the email is already registered"""
+    try:
+        get_db().execute(f"INSERT INTO users ({', '.join(USER_FIELDS)}) VALUES ({', '.join('?' * len(USER_FIELDS))})",
+                         [user.get(field) for field in USER_FIELDS])
+    except sqlite3.IntegrityError:
+        return False
+    return True
+
+
+def update_user(user_id: str, **fields) -> bool:
+    """Update account fields (name, email, profile_picture); False if the new email is taken"""
+    fields = {k: v for k, v in fields.items() if k in USER_FIELDS and k != 'id'}
+    if not fields:
+        return True
+    try:
+        get_db().execute(f"UPDATE users SET {', '.join(f'{k} = ?' for k in fields)} WHERE id = ?",
+                         list(fields.values()) + [user_id])
+    except sqlite3.IntegrityError:
+        return False
+    return True
+
+
+def get_recent_sessions(limit: int = 50) -> list:
+    """The most recently finished sessions of all users, newest first"""
+    rows = get_db().execute(
+        f"SELECT {', '.join(USER_SESSION_FIELDS)} FROM user_sessions ORDER BY id DESC LIMIT ?", (limit,)).fetchall()
+    return [dict(row) for row in rows]
+
+
+def get_user_sessions(user_id: str, limit: int | None = None) -> list:
+    """A user's session summaries, oldest first; ``limit`` keeps only the most recent ones"""
+    rows = get_db().execute(
+        f"SELECT {', '.join(USER_SESSION_FIELDS)} FROM user_sessions WHERE user_id = ? ORDER BY id DESC LIMIT ?",
+        (user_id, -1 if limit is None else limit)).fetchall()
+    return [dict(row) for row in reversed(rows)]
+
+
+# New questions and answers are appended to this journal, one JSON line each,
+# and folded into the QUESTIONS_FILE snapshot every QUESTIONS_COMPACT_EVERY lines.
+QUESTIONS_JOURNAL = os.environ.get('QUESTIONS_JOURNAL', 'questions.journal')
+QUESTIONS_COMPACT_EVERY = int(os.environ.get('QUESTIONS_COMPACT_EVERY', 500))
+
+
+class QuestionJournal:
+    """Q&A store: a JSON snapshot plus an append-only journal of changes.
+
+    Writers append one record under an exclusive ``flock`` on a lock file,
+    so gunicorn workers never lose each other's updates. Each process keeps
+    the snapshot with the journal applied in memory and only reads journal
+    lines it has not seen yet. Compaction rewrites the snapshot and starts a
+    new journal whose first line carries the next generation number; other
+    processes notice the new generation and reload. Applying a record twice
+    is harmless, so a crash between the two steps of a compaction only
+    replays records the snapshot already has.
+    """
+
+    def __init__(self, snapshot_path: str, journal_path: str, compact_every: int = QUESTIONS_COMPACT_EVERY):
+        self.snapshot_path = snapshot_path
+        self.journal_path = journal_path
+        self.lock_path = journal_path + '.lock'
+        self.compact_every = compact_every
+        self.questions = None
+        self.by_id = {}
+        self.generation = None
+        self.offset = 0
+        self.entries = 0
+        self._lock = threading.Lock()
+
+    def _flock(self, exclusive: bool):
+        handle = open(self.lock_path, 'a')
+        if fcntl is not None:
+            fcntl.flock(handle, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+        return handle
+
+    def _apply(self, record: dict):
+        if record.get('op') == 'question':
+            question = record['question']
+            if question['id'] not in self.by_id:
+                self.questions.append(question)
+                self.by_id[question['id']] = question
+        elif record.get('op') == 'answer':
+            question = self.by_id.get(record['question_id'])
+            answer = record['answer']
+            if question is not None and all(a.get('id') != answer.get('id') for a in question['answers']):
+                question['answers'].append(answer)
+                question['status'] = 'answered'
+
+    def _journal_generation(self):
+        """Generation in the journal's header line; None without a journal, 0 for one without a header"""
+        try:
+            with open(self.journal_path, 'rb') as f:
+                header = f.readline()
+        except FileNotFoundError:
+            return None
+        try:
+            record = json.loads(header)
+        except ValueError:
+            return 0
+        return record.get('generation', 0) if record.get('op') == 'generation' else 0
+
+    def _load_snapshot(self, generation):
+        self.generation = generation
         try:
-            with open(USERS_FILE, 'r') as f:
-                return json.load(f)
-        except:
-            return {}
-    return {}
+            with open(self.snapshot_path, 'r') as f:
+                self.questions = json.load(f)
+        except (OSError, ValueError):
+            self.questions = []
+        self.by_id = {q['id']: q for q in self.questions}
+        self.offset, self.entries = 0, 0
+
+    def _catch_up(self):
+        """Apply journal lines written since the last call (by any process); caller holds the file lock"""
+        generation = self._journal_generation()
+        if self.questions is None or generation != self.generation:
+            self._load_snapshot(generation)  # first use, or another process compacted
+        if generation is None:
+            return
+        with open(self.journal_path, 'rb') as f:
+            f.seek(self.offset)
+            for line in f:
+                if not line.endswith(b'\n'):
+                    break  # a write still in progress
+                self.offset += len(line)
+                try:
+                    record = json.loads(line)
+                    if record.get('op') != 'generation':
+                        self.entries += 1
+                        self._apply(record)
+                except (ValueError, KeyError, AttributeError):
+                    print(f"Skipping bad line in {self.journal_path}")
+
+    def all(self) -> list:
+        with self._lock:
+            handle = self._flock(exclusive=False)
+            try:
+                self._catch_up()
+                return list(self.questions)
+            finally:
+                handle.close()
+
+    def get(self, question_id: str) -> dict | None:
+        with self._lock:
+            handle = self._flock(exclusive=False)
+            try:
+                self._catch_up()
+                return self.by_id.get(question_id)
+            finally:
+                handle.close()
+
+    def append(self, record: dict):
+        """Journal one change and apply it, compacting when the journal is long enough"""
+        line = (json.dumps(record) + '\n').encode()
+        with self._lock:
+            handle = self._flock(exclusive=True)
+            try:
+                self._catch_up()
+                if self.generation is None:
+                    self._start_journal(0)
+                with open(self.journal_path, 'ab') as f:
+                    f.write(line)
+                self.offset += len(line)
+                self.entries += 1
+                self._apply(record)
+                if self.entries >= self.compact_every:
+                    self._compact()
+            finally:
+                handle.close()
+
+    def _start_journal(self, generation: int):
+        """Replace the journal with an empty one of ``generation``; caller holds the exclusive file lock"""
+        header = (json.dumps({'op': 'generation', 'generation': generation}) + '\n').encode()
+        with open(self.journal_path + '.tmp', 'wb') as f:
+            f.write(header)
+        os.replace(self.journal_path + '.tmp', self.journal_path)
+        self.generation = generation
+        self.offset, self.entries = len(header), 0
+
+    def _compact(self):
+        """Fold the journal into the snapshot; caller holds the exclusive file lock"""
+        tmp_path = self.snapshot_path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(self.questions, f, indent=2)
+        os.replace(tmp_path, self.snapshot_path)
+        self._start_journal((self.generation or 0) + 1)
+
+    def compact(self):
+        with self._lock:
+            handle = self._flock(exclusive=True)
+            try:
+                self._catch_up()
+                self._compact()
+            finally:
+                handle.close()
+
+
+question_store = QuestionJournal(QUESTIONS_FILE, QUESTIONS_JOURNAL)
 
-def save_users(users):
-    """Save users to JSON file"""
-    with open(USERS_FILE, 'w') as f:
-        json.dump(users, f, indent=2)
 
 def load_questions():
-    """Load questions from JSON file"""
-    if os.path.exists(QUESTIONS_FILE):
-        try:
-            with open(QUESTIONS_FILE, 'r') as f:
-                return json.load(f)
-        except:
-            return []
-    return []
+    """All questions, in the order they were asked"""
+    return question_store.all()
 
-def save_questions(questions):
-    """Save questions to JSON file"""
-    with open(QUESTIONS_FILE, 'w') as f:
-        json.dump(questions, f, indent=2)
+
+def add_question(question: dict):
+    question_store.append({'op': 'question', 'question': question})
+
+
+def add_answer(question_id: str, answer: dict):
+    question_store.append({'op': 'answer', 'question_id': question_id, 'answer': answer})
 
 def hash_password(password):
     """Hash password using SHA-256"""
@@ -69,6 +522,8 @@ def verify_password(password, hashed):
     """Verify password against hash"""
     return hash_password(password) == hashed
 
+init_user_db()
+
 # Initialize MediaPipe Pose
 if MEDIAPIPE_AVAILABLE:
     mp_pose = mp.solutions.pose
@@ -77,437 +532,2827 @@ else:
     mp_pose = None
     mp_drawing = None
 
-# In-memory session store
-sessions = {}
-session_history = []  # lightweight metadata records for history page
+# Finished sessions stay in memory for SESSION_TTL_S after they end, or until
+# live sessions need the room under SESSION_MEMORY_MB. After that they are
+# reloaded from disk on demand. SESSION_STORE=sqlite keeps the metadata of
+# finished sessions in USERS_DB, so any worker can serve them; memory keeps
+# them in this process only.
+SESSION_TTL_S = float(os.environ.get('SESSION_TTL_S', 600))
+SESSION_MEMORY_MB = float(os.environ.get('SESSION_MEMORY_MB', 256))
+SESSION_STORE = os.environ.get('SESSION_STORE', 'sqlite').strip().lower()
+# Saved sessions (and their landmarks and replay video) are deleted this many
+# days after they finished; 0 keeps them forever. Their CSV and .npz exports stay.
+SESSION_RETENTION_DAYS = float(os.environ.get('SESSION_RETENTION_DAYS', 30))
+# A replay render claimed this long ago by a worker that never finished it may be taken over.
+RENDER_CLAIM_TIMEOUT_S = float(os.environ.get('RENDER_CLAIM_TIMEOUT_S', 600))
+
+# Plain fields of a finished session that are saved with it; records go to an
+# .npz file next to its CSV, and landmarks are found again by their cache key
+# (live sessions, which have no video to key them by, write their own .npz).
+PERSISTED_SESSION_FIELDS = ('video_path', 'exercise', 'options', 'user_id', 'created_at', 'current_metrics',
+                            'csv_path', 'npz_path', 'landmarks_key', 'landmarks_path', 'video_state', 'video_export',
+                            'finished_at', 'basic_mode')
+
+
+class SqliteSessionStore:
+    """Finished sessions' metadata in the users database, shared by all workers"""
+
+    def save(self, session_id: str, data: dict):
+        get_db().execute('INSERT OR REPLACE INTO analysis_sessions (id, data, finished_at) VALUES (?, ?, ?)',
+                         (session_id, json.dumps(data), data.get('finished_at') or time.time()))
+
+    def load(self, session_id: str) -> dict | None:
+        row = get_db().execute('SELECT data FROM analysis_sessions WHERE id = ?', (session_id,)).fetchone()
+        return json.loads(row['data']) if row else None
+
+    def update(self, session_id: str, fields: dict):
+        """Overwrite some fields of a saved session in place"""
+        get_db().execute(
+            f"UPDATE analysis_sessions SET data = json_set(data, {', '.join('?, json(?)' for _ in fields)}) WHERE id = ?",
+            [value for name, field in fields.items() for value in (f'$.{name}', json.dumps(field))] + [session_id])
+
+    def claim_render(self, session_id: str) -> bool:
+        """Mark a saved session's replay as rendering unless any worker already has (or has finished) it"""
+        now = time.time()
+        cursor = get_db().execute('''
+            UPDATE analysis_sessions
+            SET data = json_set(data, '$.video_state', 'rendering', '$.render_claimed_at', ?)
+            WHERE id = ? AND (json_extract(data, '$.video_state') IS NULL
+                              OR (json_extract(data, '$.video_state') = 'rendering'
+                                  AND COALESCE(json_extract(data, '$.render_claimed_at'), 0) < ?))
+        ''', (now, session_id, now - RENDER_CLAIM_TIMEOUT_S))
+        return cursor.rowcount > 0 or self.load(session_id) is None
+
+    def prune(self, finished_before: float) -> list:
+        """Delete sessions that finished before ``finished_before``; returns their saved fields"""
+        conn = get_db()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            rows = conn.execute('SELECT data FROM analysis_sessions WHERE finished_at < ?', (finished_before,)).fetchall()
+            conn.execute('DELETE FROM analysis_sessions WHERE finished_at < ?', (finished_before,))
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        return [json.loads(row['data']) for row in rows]
+
+
+class SessionRegistry:
+    """Analysis sessions by id, with a dict-like interface.
+
+    Running sessions always stay in memory (they own threads and
+    conditions). Finished ones are saved to ``store`` when they finish and
+    dropped from memory, least recently used first, once they are older than
+    ``ttl`` or the sessions in memory exceed ``memory_budget`` bytes. A lookup
+    that misses memory reloads the session from ``store``. Without a store,
+    evicted sessions are gone.
+    """
+
+    def __init__(self, store=None, ttl: float = SESSION_TTL_S, memory_budget: float = SESSION_MEMORY_MB * 1024 * 1024,
+                 retention_days: float = SESSION_RETENTION_DAYS):
+        self.store = store
+        self.ttl = ttl
+        self.memory_budget = memory_budget
+        self.retention_s = retention_days * 86400
+        self.sessions = OrderedDict()
+        self._lock = threading.RLock()
+        self._last_sweep = 0.0
+        self._last_prune = 0.0
+
+    def __setitem__(self, session_id: str, session: dict):
+        with self._lock:
+            self.sessions[session_id] = session
+            self.sessions.move_to_end(session_id)
+        self.evict()
+
+    def __getitem__(self, session_id: str) -> dict:
+        session = self.get(session_id)
+        if session is None:
+            raise KeyError(session_id)
+        return session
+
+    def __contains__(self, session_id) -> bool:
+        return self.get(session_id) is not None
+
+    def __delitem__(self, session_id: str):
+        with self._lock:
+            del self.sessions[session_id]
+
+    def __len__(self):
+        return len(self.sessions)
+
+    def get(self, session_id: str, default=None):
+        with self._lock:
+            session = self.sessions.get(session_id)
+            if session is not None:
+                self.sessions.move_to_end(session_id)
+        if session is None and self.store is not None:
+            data = self.store.load(session_id)
+            if data is not None:
+                session = restore_session(data)
+                with self._lock:
+                    session = self.sessions.setdefault(session_id, session)
+        if time.monotonic() - self._last_sweep > 5.0:
+            self.evict()
+        return session if session is not None else default
+
+    def finished(self, session_id: str, session: dict):
+        """Save a session that just finished so other workers (and later requests) can load it"""
+        session['finished_at'] = time.time()
+        self.save(session_id, session)
+
+    def save(self, session_id: str, session: dict):
+        if self.store is None:
+            return
+        try:
+            if (session.get('landmarks') is not None and not session.get('landmarks_key')
+                    and not session.get('landmarks_path')):
+                path = session_output_path(session_id, 'landmarks.npz')
+                np.savez(path, **session['landmarks'].arrays())
+                session['landmarks_path'] = path
+            self.store.save(session_id, {name: session.get(name) for name in PERSISTED_SESSION_FIELDS})
+        except (OSError, sqlite3.Error) as e:
+            print(f"Could not save session {session_id}: {e}")
+
+    def save_video_state(self, session_id: str, session: dict):
+        """Share a change of a session's replay video with the other workers"""
+        if self.store is None:
+            return
+        try:
+            self.store.update(session_id, {name: session.get(name) for name in ('video_state', 'video_export')})
+        except sqlite3.Error as e:
+            print(f"Could not save video state of session {session_id}: {e}")
+
+    def claim_render(self, session_id: str, session: dict) -> bool:
+        """True if this worker may render the session's replay.
+
+        Otherwise another worker is rendering it or has finished; a finished
+        state is copied into ``session`` so it can be served from here.
+        """
+        if self.store is None:
+            return True
+        try:
+            if self.store.claim_render(session_id):
+                return True
+            data = self.store.load(session_id) or {}
+            if data.get('video_state') == 'ready' and not os.path.exists(data.get('video_export') or ''):
+                self.store.update(session_id, {'video_state': None})  # the file is gone: render it again
+                return self.store.claim_render(session_id)
+        except sqlite3.Error as e:
+            print(f"Could not claim the replay render of session {session_id}: {e}")
+            return False
+        if data.get('video_state') in ('ready', 'failed'):
+            session['video_state'] = data['video_state']
+            session['video_export'] = data.get('video_export')
+        return False
+
+    @staticmethod
+    def evictable(session: dict) -> bool:
+        return (session.get('is_done') and session.get('finished_at') is not None
+                and session.get('viewers', 0) <= 0 and session.get('video_state') != 'rendering')
+
+    @staticmethod
+    def nbytes(session: dict) -> int:
+        """Approximate memory held by a session's records, landmarks and buffered frames"""
+        total = sum(len(frame_bytes) for _, _, frame_bytes in session.get('recent_frames', ()))
+        records = session.get('records')
+        if records is not None:
+            total += sum(column.nbytes for column in records.columns.values())
+        landmarks = session.get('landmarks')
+        if landmarks is not None and not isinstance(landmarks.coords, np.memmap):
+            total += sum(getattr(landmarks, name).nbytes for name in ('coords', 'visibility', 'frames', 'timestamps'))
+        return total
+
+    def evict(self):
+        """Drop finished sessions past their TTL, then least recently used ones while over budget"""
+        now = time.time()
+        self._last_sweep = time.monotonic()
+        evicted = []
+        with self._lock:
+            sizes = {sid: self.nbytes(session) for sid, session in self.sessions.items()}
+            total = sum(sizes.values())
+            for sid, session in list(self.sessions.items()):  # least recently used first
+                if not self.evictable(session):
+                    continue
+                if now - session['finished_at'] > self.ttl or total > self.memory_budget:
+                    del self.sessions[sid]
+                    total -= sizes[sid]
+                    evicted.append((sid, session))
+        if self.store is not None and self.retention_s > 0 and now - self._last_prune > 3600:
+            self._last_prune = now
+            self.prune(now - self.retention_s)
+
+    def prune(self, finished_before: float):
+        """Delete saved sessions that finished before ``finished_before``, with their output files.
+
+        Cached landmarks are shared by every session of the same video and
+        are left to the landmark cache's own eviction.
+        """
+        try:
+            expired = self.store.prune(finished_before)
+        except sqlite3.Error as e:
+            print(f"Could not prune saved sessions: {e}")
+            return
+        for data in expired:
+            for path in (data.get('csv_path'), data.get('npz_path'), data.get('landmarks_path'), data.get('video_export')):
+                if path:
+                    try:
+                        os.remove(path)
+                    except OSError:
+                        pass
+        if expired:
+            print(f"Pruned {len(expired)} saved sessions")
+
+
+def restore_session(data: dict) -> dict:
+    """Rebuild a finished session from its saved fields, .npz files and cached landmarks"""
+    session = create_analysis_session(data.get('video_path'), data.get('exercise', 'pushup'),
+                                      data.get('user_id'), data.get('options') or {})
+    session.update({name: data.get(name) for name in PERSISTED_SESSION_FIELDS})
+    session['is_done'] = True
+    session['job'] = False  # finished: never start analysis again
+    session['current_metrics'] = data.get('current_metrics') or session['current_metrics']
+    if session.get('npz_path') and os.path.exists(session['npz_path']):
+        session['records'] = SessionRecords.from_npz(session['npz_path'])
+        session['summary'] = RunningSummary.from_records(session['records'])
+    if session.get('landmarks_key'):
+        session['landmarks'] = load_cached_landmarks(session['landmarks_key'])
+    elif session.get('landmarks_path') and os.path.exists(session['landmarks_path']):
+        with np.load(session['landmarks_path']) as arrays:
+            session['landmarks'] = LandmarkBuffer.from_arrays(dict(arrays))
+    if session.get('video_state') == 'rendering' or (
+            session.get('video_state') == 'ready' and not os.path.exists(session.get('video_export') or '')):
+        session['video_state'] = None  # ask the store again (claim_render) if the replay is requested
+    return session
+
+
+sessions = SessionRegistry(SqliteSessionStore() if SESSION_STORE == 'sqlite' else None)
 
 
 GEMINI_MODEL = os.environ.get('GEMINI_MODEL', 'gemini-1.5-flash')
 GEMINI_URL = f"https://generativelanguage.googleapis.com/v1beta/models/{GEMINI_MODEL}:generateContent"
 
 
-def calculate_angle(a, b, c):
-    a = np.array(a)
-    b = np.array(b)
-    c = np.array(c)
-    radians = np.arctan2(c[1] - b[1], c[0] - b[0]) - np.arctan2(a[1] - b[1], a[0] - b[0])
-    angle = np.abs(radians * 180.0 / np.pi)
-    if angle > 180.0:
-        angle = 360 - angle
-    return angle
+class RunningStat:
+    """Count, mean, variance (Welford) and range of a stream of values"""
 
+    __slots__ = ('n', 'mean', 'm2', 'min', 'max')
 
-def aggregate_session_summary(records: list[dict]) -> dict:
-    summary = {
-        'total_frames': 0,
-        'total_reps': 0,
-        'duration_ms': 0.0,
-        'avg_elbow_angle': 0.0,
-        'avg_hip_angle': 0.0,
-        'min_elbow_angle': None,
-        'max_elbow_angle': None,
-        'min_hip_angle': None,
-        'max_hip_angle': None,
-        'hip_warning_frames': 0,
-        'go_lower_frames': 0,
-        'good_form_frames': 0,
-        'last_feedback': ''
+    def __init__(self):
+        self.n = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.min = None
+        self.max = None
+
+    def add(self, x: float):
+        self.n += 1
+        delta = x - self.mean
+        self.mean += delta / self.n
+        self.m2 += delta * (x - self.mean)
+        self.min = x if self.min is None or x < self.min else self.min
+        self.max = x if self.max is None or x > self.max else self.max
+
+    @property
+    def std(self) -> float:
+        return (self.m2 / self.n) ** 0.5 if self.n else 0.0
+
+    @classmethod
+    def from_array(cls, values) -> 'RunningStat':
+        stat = cls()
+        values = np.asarray(values, dtype=np.float64)
+        if len(values):
+            stat.n = len(values)
+            stat.mean = float(values.mean())
+            stat.m2 = float(((values - stat.mean) ** 2).sum())
+            stat.min = float(values.min())
+            stat.max = float(values.max())
+        return stat
+
+
+class RunningSummary:
+    """Session statistics kept up to date one record at a time.
+
+    ``update`` is O(1), so ``/metrics`` can serve the summary of a running
+    session and ``/insights`` never rescans the records. Besides totals and
+    angle statistics it tracks a feedback histogram, the time each rep took
+    and a rolling window over the last ``WINDOW`` frames.
+    """
+
+    WINDOW = 90  # frames, about 3 s of 30 fps video
+
+    def __init__(self):
+        self.frames = 0
+        self.reps = 0
+        self.first_ts = None
+        self.last_ts = 0.0
+        self.last_feedback = ''
+        self.elbow = RunningStat()
+        self.hip = RunningStat()
+        self.feedback = Counter()
+        self.rep_durations = []  # seconds per rep, the first one measured from the session start
+        self.rep_stat = RunningStat()
+        self.last_rep_ts = None
+        self.window = deque()
+        self.window_elbow = 0.0
+        self.window_hip = 0.0
+
+    def _add_rep(self, timestamp_ms: float):
+        start = self.last_rep_ts if self.last_rep_ts is not None else self.first_ts
+        duration = max(0.0, (timestamp_ms - start) / 1000.0)
+        self.rep_durations.append(duration)
+        self.rep_stat.add(duration)
+        self.last_rep_ts = timestamp_ms
+
+    def _push_window(self, timestamp_ms: float, elbow: float, hip: float, count: int):
+        self.window.append((timestamp_ms, elbow, hip, count))
+        self.window_elbow += elbow
+        self.window_hip += hip
+        if len(self.window) > self.WINDOW:
+            _, old_elbow, old_hip, _ = self.window.popleft()
+            self.window_elbow -= old_elbow
+            self.window_hip -= old_hip
+
+    def update(self, record: dict):
+        timestamp_ms = float(record.get('timestamp_ms', 0.0))
+        elbow = float(record.get('elbow_angle', 0.0))
+        hip = float(record.get('hip_angle', 0.0))
+        count = int(record.get('count', 0))
+        if self.first_ts is None:
+            self.first_ts = timestamp_ms
+        self.frames += 1
+        self.last_ts = timestamp_ms
+        self.elbow.add(elbow)
+        self.hip.add(hip)
+        self.last_feedback = record.get('feedback', '')
+        self.feedback[self.last_feedback] += 1
+        if count > self.reps:
+            self._add_rep(timestamp_ms)
+        self.reps = count
+        self._push_window(timestamp_ms, elbow, hip, count)
+
+    @classmethod
+    def from_records(cls, records) -> 'RunningSummary':
+        """Summary of already finished records, computed column-wise"""
+        summary = cls()
+        if not len(records):
+            return summary
+        if not isinstance(records, SessionRecords):
+            records = SessionRecords.from_rows(records)
+        timestamps = records.column('timestamp_ms')
+        elbow = records.column('elbow_angle').astype(np.float64)
+        hip = records.column('hip_angle').astype(np.float64)
+        counts = records.column('count')
+
+        summary.frames = len(records)
+        summary.first_ts = float(timestamps[0])
+        summary.last_ts = float(timestamps[-1])
+        summary.reps = int(counts[-1])
+        summary.elbow = RunningStat.from_array(elbow)
+        summary.hip = RunningStat.from_array(hip)
+        hits = np.bincount(records.column('feedback'), minlength=len(records.labels['feedback']))
+        summary.feedback = Counter({label: int(n) for label, n in zip(records.labels['feedback'], hits) if n})
+        summary.last_feedback = records.labels['feedback'][records.column('feedback')[-1]]
+        for i in np.flatnonzero(np.diff(counts, prepend=0) > 0):
+            summary._add_rep(float(timestamps[i]))
+        for i in range(max(0, len(records) - cls.WINDOW), len(records)):
+            summary._push_window(float(timestamps[i]), float(elbow[i]), float(hip[i]), int(counts[i]))
+        return summary
+
+    def summary(self, rep_durations: bool = True) -> dict:
+        result = {
+            'total_frames': self.frames,
+            'total_reps': self.reps,
+            'duration_ms': max(0.0, self.last_ts - self.first_ts) if self.first_ts is not None else 0.0,
+            'avg_elbow_angle': self.elbow.mean,
+            'avg_hip_angle': self.hip.mean,
+            'min_elbow_angle': self.elbow.min,
+            'max_elbow_angle': self.elbow.max,
+            'min_hip_angle': self.hip.min,
+            'max_hip_angle': self.hip.max,
+            'std_elbow_angle': self.elbow.std,
+            'std_hip_angle': self.hip.std,
+            'hip_warning_frames': self.feedback['Keep your hips straight!'],
+            'go_lower_frames': self.feedback['Go lower!'],
+            'good_form_frames': self.feedback['Good form!'],
+            'last_feedback': self.last_feedback,
+            'feedback_counts': dict(self.feedback),
+            'avg_rep_s': self.rep_stat.mean,
+            'fastest_rep_s': self.rep_stat.min,
+            'last_rep_s': self.rep_durations[-1] if self.rep_durations else None,
+        }
+        if rep_durations:
+            result['rep_durations_s'] = list(self.rep_durations)
+
+        window = len(self.window)
+        recent = {'frames': window, 'seconds': 0.0, 'avg_elbow_angle': 0.0, 'avg_hip_angle': 0.0,
+                  'reps': 0, 'reps_per_min': 0.0}
+        if window:
+            seconds = (self.window[-1][0] - self.window[0][0]) / 1000.0
+            reps = self.window[-1][3] - self.window[0][3]
+            recent.update({
+                'seconds': seconds,
+                'avg_elbow_angle': self.window_elbow / window,
+                'avg_hip_angle': self.window_hip / window,
+                'reps': reps,
+                'reps_per_min': reps * 60.0 / seconds if seconds > 0 else 0.0,
+            })
+        result['recent'] = recent
+        return result
+
+
+def aggregate_session_summary(records) -> dict:
+    """Totals, angle ranges and feedback counts over a session's records"""
+    return RunningSummary.from_records(records).summary()
+
+
+def draw_basic_overlay(frame, exercise: str, count: int):
+    """Rep counter and mode banner of the basic analysis mode (no landmarks to draw)"""
+    cv2.putText(frame, f"{get_exercise(exercise)['label']}: {count}", (20, 40),
+                cv2.FONT_HERSHEY_SIMPLEX, 1, (0, 255, 0), 2, cv2.LINE_AA)
+    cv2.putText(frame, "Basic Analysis Mode", (20, 80),
+                cv2.FONT_HERSHEY_SIMPLEX, 0.9, (255, 165, 0), 2, cv2.LINE_AA)
+    cv2.putText(frame, exercise.replace('_', ' ').title(), (20, 120),
+                cv2.FONT_HERSHEY_SIMPLEX, 0.8, (0, 255, 255), 2, cv2.LINE_AA)
+
+
+def analyze_video_simple(session_id: str, cap):
+    """Simple video analysis without MediaPipe (fallback)"""
+    session = sessions.get(session_id)
+    if not session:
+        return
+
+    count = 0
+    session['basic_mode'] = True
+    records = SessionRecords()
+    summary = session['summary'] = RunningSummary()
+    csv_out = CsvRecordWriter(session_output_path(session_id, 'csv'))
+    session['csv_path'] = csv_out.path
+    frame_count = 0
+    exercise = session.get('exercise', 'pushup')
+    rule = get_exercise(exercise)
+    
+    # Basic timing for different exercises
+    count_interval = rule['simple_interval']
+    prefetch = (PrefetchCapture(cap)
+                if PIPELINE_DECODE_DEPTH > 0 and not isinstance(cap, SharedMemoryCapture) else None)
+    source = prefetch or cap
+
+    try:
+        while source.isOpened():
+            ret, frame = source.read()
+            if not ret:
+                break
+
+            frame_count += 1
+            current_timestamp_ms = source.get(cv2.CAP_PROP_POS_MSEC)
+            
+            # Exercise-specific counting
+            if 'timer' in rule:
+                # Count seconds for plank
+                count = frame_count // 30  # Assuming 30 FPS
+                feedback = "Hold steady position"
+            else:
+                # Count reps for other exercises
+                if frame_count % count_interval == 0:
+                    count += 1
+                feedback = f"Basic {exercise.replace('_', ' ')} analysis"
+
+            record = {
+                "frame": frame_count,
+                "timestamp_ms": float(current_timestamp_ms) if current_timestamp_ms is not None else 0.0,
+                "elbow_angle": 90.0,
+                "hip_angle": 180.0,
+                "stage": "up",
+                "count": count,
+                "feedback": feedback,
+            }
+            records.append(record)
+            summary.update(record)
+            csv_out.write(record)
+
+            # Update live metrics
+            set_live_metrics(session, {
+                'count': count,
+                'feedback': feedback,
+                'elbow_angle': 90,
+                'hip_angle': 180,
+            })
+
+            # Nobody is watching: skip drawing and encoding entirely
+            if session.get('viewers', 0) <= 0:
+                continue
+
+            draw_basic_overlay(frame, exercise, count)
+            ret2, buffer = cv2.imencode('.jpg', frame, [cv2.IMWRITE_JPEG_QUALITY, JPEG_QUALITY])
+            if not ret2:
+                continue
+            yield record['timestamp_ms'], buffer.tobytes()
+    finally:
+        if prefetch is not None:
+            prefetch.close()
+        cap.release()
+        finish_session(session_id, session, records, csv_out)
+
+
+# Long side (pixels) frames are downscaled to before pose inference; 0 keeps full resolution.
+# Can be overridden per upload with the ``inference_size`` form field.
+INFERENCE_LONG_SIDE = int(os.environ.get('INFERENCE_LONG_SIDE', 480))
+
+
+def parse_inference_size(value, default: int = INFERENCE_LONG_SIDE) -> int:
+    """Validate a requested inference long side, falling back to the deployment default"""
+    try:
+        size = int(value)
+    except (TypeError, ValueError):
+        return default
+    if size == 0:
+        return 0
+    return min(max(size, 128), 1920)
+
+
+def resize_for_inference(frame, long_side: int):
+    """Downscale a frame so its long side is at most ``long_side`` pixels"""
+    h, w = frame.shape[:2]
+    if not long_side or max(h, w) <= long_side:
+        return frame
+    scale = long_side / float(max(h, w))
+    return cv2.resize(frame, (max(1, int(round(w * scale))), max(1, int(round(h * scale)))),
+                      interpolation=cv2.INTER_AREA)
+
+
+# Joint angles computed by the batch engine: name -> (a, b, c) landmark indices,
+# the angle being measured at b. "hip" is the shoulder-hip-ankle body line the
+# exercise rules have always used.
+JOINT_ANGLES = {
+    'elbow_l': (11, 13, 15),
+    'elbow_r': (12, 14, 16),
+    'shoulder_l': (13, 11, 23),
+    'shoulder_r': (14, 12, 24),
+    'hip_l': (11, 23, 27),
+    'hip_r': (12, 24, 28),
+    'knee_l': (23, 25, 27),
+    'knee_r': (24, 26, 28),
+}
+JOINT_NAMES = list(JOINT_ANGLES)
+_JOINT_A, _JOINT_B, _JOINT_C = (np.array(idx) for idx in zip(*JOINT_ANGLES.values()))
+
+
+def joint_angles(coords) -> np.ndarray:
+    """Vectorized joint angles for a stack of poses.
+
+    ``coords`` is ``(frames, 33, >=2)`` (a single ``(33, >=2)`` pose also
+    works); returns ``(frames, len(JOINT_NAMES))`` float32 degrees in
+    [0, 180]: the angle at ``b`` between the image-plane rays to ``a`` and ``c``.
+    """
+    coords = np.asarray(coords, dtype=np.float32)
+    a = coords[..., _JOINT_A, :2]
+    b = coords[..., _JOINT_B, :2]
+    c = coords[..., _JOINT_C, :2]
+    radians = (np.arctan2(c[..., 1] - b[..., 1], c[..., 0] - b[..., 0])
+               - np.arctan2(a[..., 1] - b[..., 1], a[..., 0] - b[..., 0]))
+    angles = np.abs(np.degrees(radians))
+    return np.where(angles > 180.0, 360.0 - angles, angles).astype(np.float32)
+
+
+class LandmarkBuffer:
+    """Per-frame pose landmarks held in preallocated float32 arrays.
+
+    ``coords`` is ``(frames, 33, 3)`` (normalised x, y, z) and ``visibility``
+    is ``(frames, 33)``; ``frames`` and ``timestamps`` hold the video frame
+    index and position of each row. Storage grows in chunks, so appending a
+    frame is a slice assignment rather than a new Python list.
+    """
+
+    def __init__(self, capacity: int = 0):
+        capacity = max(int(capacity), 256)
+        self.coords = np.zeros((capacity, 33, 3), dtype=np.float32)
+        self.visibility = np.zeros((capacity, 33), dtype=np.float32)
+        self.frames = np.zeros(capacity, dtype=np.int32)
+        self.timestamps = np.zeros(capacity, dtype=np.float64)
+        self.size = 0
+
+    def __len__(self):
+        return self.size
+
+    def _reserve(self, extra: int):
+        needed = self.size + extra
+        capacity = len(self.frames)
+        if needed <= capacity:
+            return
+        capacity = max(needed, capacity * 2)
+        for name in ('coords', 'visibility', 'frames', 'timestamps'):
+            old = getattr(self, name)
+            new = np.zeros((capacity,) + old.shape[1:], dtype=old.dtype)
+            new[:self.size] = old[:self.size]
+            setattr(self, name, new)
+
+    def extend(self, frame_indices, timestamps, landmarks):
+        """Append ``k`` frames; ``landmarks`` is ``(k, 33, 4)`` of x, y, z, visibility"""
+        k = len(frame_indices)
+        if not k:
+            return
+        self._reserve(k)
+        rows = slice(self.size, self.size + k)
+        self.coords[rows] = landmarks[:, :, :3]
+        self.visibility[rows] = landmarks[:, :, 3]
+        self.frames[rows] = frame_indices
+        self.timestamps[rows] = [t if t is not None else 0.0 for t in timestamps]
+        self.size += k
+
+    def arrays(self) -> dict:
+        """Trimmed views of the filled rows"""
+        n = self.size
+        return {
+            'coords': self.coords[:n],
+            'visibility': self.visibility[:n],
+            'frames': self.frames[:n],
+            'timestamps': self.timestamps[:n],
+        }
+
+    def extend_arrays(self, arrays: dict):
+        """Append rows in the format returned by ``arrays()``"""
+        landmarks = np.concatenate([arrays['coords'], arrays['visibility'][..., None]], axis=-1)
+        self.extend(arrays['frames'], arrays['timestamps'], landmarks)
+
+    @classmethod
+    def from_arrays(cls, arrays: dict, copy: bool = True) -> 'LandmarkBuffer':
+        """Build a buffer from ``arrays()`` output; ``copy=False`` wraps them as-is (e.g. memory-mapped)"""
+        if copy:
+            buffer = cls(len(arrays['frames']))
+            buffer.extend_arrays(arrays)
+            return buffer
+        buffer = cls.__new__(cls)
+        for name in ('coords', 'visibility', 'frames', 'timestamps'):
+            setattr(buffer, name, arrays[name])
+        buffer.size = len(arrays['frames'])
+        return buffer
+
+
+class SessionRecords:
+    """Per-frame session records stored column by column.
+
+    Frame, timestamp, angles and count live in typed arrays; stage and
+    feedback are small integer codes into per-session string tables. Rows
+    are still available as dicts (``records[i]``, iteration) for code that
+    expects the old list of records, but nothing per frame is kept as a
+    Python object.
+    """
+
+    FIELDS = ("frame", "timestamp_ms", "elbow_angle", "hip_angle", "stage", "count", "feedback")
+    DTYPES = {
+        'frame': np.int32,
+        'timestamp_ms': np.float64,
+        'elbow_angle': np.float32,
+        'hip_angle': np.float32,
+        'stage': np.uint16,
+        'count': np.int32,
+        'feedback': np.uint16,
     }
+    CHUNK = 4096
+
+    def __init__(self):
+        self.columns = {name: np.zeros(self.CHUNK, dtype=dtype) for name, dtype in self.DTYPES.items()}
+        self.labels = {'stage': [], 'feedback': []}
+        self.codes = {'stage': {}, 'feedback': {}}
+        self.size = 0
+
+    def __len__(self):
+        return self.size
+
+    def _reserve(self, extra: int):
+        needed = self.size + extra
+        capacity = len(self.columns['frame'])
+        if needed <= capacity:
+            return
+        capacity = max(needed, capacity + max(self.CHUNK, capacity // 2))
+        for name, old in self.columns.items():
+            new = np.zeros(capacity, dtype=old.dtype)
+            new[:self.size] = old[:self.size]
+            self.columns[name] = new
+
+    def _code(self, name: str, value: str) -> int:
+        code = self.codes[name].get(value)
+        if code is None:
+            code = self.codes[name][value] = len(self.labels[name])
+            self.labels[name].append(value)
+        return code
+
+    def append(self, record: dict):
+        self._reserve(1)
+        i = self.size
+        columns = self.columns
+        columns['frame'][i] = record['frame']
+        columns['timestamp_ms'][i] = record['timestamp_ms']
+        columns['elbow_angle'][i] = record['elbow_angle']
+        columns['hip_angle'][i] = record['hip_angle']
+        columns['stage'][i] = self._code('stage', record['stage'])
+        columns['count'][i] = record['count']
+        columns['feedback'][i] = self._code('feedback', record['feedback'])
+        self.size += 1
+
+    def extend_columns(self, values: dict):
+        """Append whole columns at once; ``stage`` and ``feedback`` are arrays of strings"""
+        k = len(values['frame'])
+        if not k:
+            return
+        self._reserve(k)
+        rows = slice(self.size, self.size + k)
+        for name in self.FIELDS:
+            if name in self.codes:
+                labels, inverse = np.unique(np.asarray(values[name], dtype=object).astype(str), return_inverse=True)
+                table = np.array([self._code(name, str(label)) for label in labels], dtype=self.DTYPES[name])
+                self.columns[name][rows] = table[inverse]
+            else:
+                self.columns[name][rows] = values[name]
+        self.size += k
+
+    @classmethod
+    def from_rows(cls, rows) -> 'SessionRecords':
+        records = cls()
+        for row in rows:
+            records.append(row)
+        return records
+
+    def column(self, name: str) -> np.ndarray:
+        """Trimmed view of one column; stage and feedback are returned as codes"""
+        return self.columns[name][:self.size]
+
+    def decoded(self, name: str) -> np.ndarray:
+        """Stage or feedback strings for every row"""
+        return np.array(self.labels[name] + [''], dtype=object)[self.column(name)]
+
+    def row(self, i: int) -> dict:
+        columns = self.columns
+        return {
+            "frame": int(columns['frame'][i]),
+            "timestamp_ms": float(columns['timestamp_ms'][i]),
+            "elbow_angle": float(columns['elbow_angle'][i]),
+            "hip_angle": float(columns['hip_angle'][i]),
+            "stage": self.labels['stage'][columns['stage'][i]],
+            "count": int(columns['count'][i]),
+            "feedback": self.labels['feedback'][columns['feedback'][i]],
+        }
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self.row(j) for j in range(*i.indices(self.size))]
+        if i < 0:
+            i += self.size
+        if not 0 <= i < self.size:
+            raise IndexError('record index out of range')
+        return self.row(i)
+
+    def __iter__(self):
+        for i in range(self.size):
+            yield self.row(i)
+
+    def to_npz(self, path: str):
+        """Write the columns (stage/feedback as codes plus their label tables) to an uncompressed .npz"""
+        tmp_path = f'{path}.tmp-{uuid.uuid4().hex}'
+        with open(tmp_path, 'wb') as f:
+            np.savez(
+                f,
+                **{name: self.column(name) for name in self.FIELDS},
+                stage_labels=np.array(self.labels['stage'], dtype=str),
+                feedback_labels=np.array(self.labels['feedback'], dtype=str),
+            )
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def from_npz(cls, path: str) -> 'SessionRecords':
+        with np.load(path) as data:
+            records = cls()
+            n = len(data['frame'])
+            records._reserve(n)
+            for name in cls.FIELDS:
+                records.columns[name][:n] = data[name]
+            for name in ('stage', 'feedback'):
+                records.labels[name] = [str(label) for label in data[f'{name}_labels']]
+                records.codes[name] = {label: i for i, label in enumerate(records.labels[name])}
+            records.size = n
+        return records
+
+    def write_csv(self, path: str):
+        """Write the session CSV (same layout as the live one) from the columns"""
+        stage = self.decoded('stage').tolist()
+        feedback = self.decoded('feedback').tolist()
+        tmp_path = f'{path}.tmp-{uuid.uuid4().hex}'  # concurrent downloads may both write it
+        with open(tmp_path, 'w', newline='') as csvfile:
+            writer = csv.writer(csvfile)
+            writer.writerow(self.FIELDS)
+            writer.writerows(zip(
+                self.column('frame').tolist(), self.column('timestamp_ms').tolist(),
+                self.column('elbow_angle').tolist(), self.column('hip_angle').tolist(),
+                stage, self.column('count').tolist(), feedback))
+        os.replace(tmp_path, path)
+
+
+# Session exports (CSV and .npz) live next to each other under static/sessions.
+SESSION_OUTPUT_DIR = os.path.join('static', 'sessions')
+# Rows buffered before the live CSV is appended to and flushed.
+CSV_FLUSH_ROWS = int(os.environ.get('CSV_FLUSH_ROWS', 256))
+
+
+def session_output_path(session_id: str, ext: str) -> str:
+    return os.path.join(SESSION_OUTPUT_DIR, f'{session_id}.{ext}')
+
+
+class CsvRecordWriter:
+    """Appends a running session's records to its CSV in buffered chunks"""
+
+    def __init__(self, path: str, flush_rows: int = CSV_FLUSH_ROWS):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.path = path
+        self.flush_rows = max(1, flush_rows)
+        self.pending = []
+        self.file = open(path, 'w', newline='')
+        self.writer = csv.DictWriter(self.file, fieldnames=SessionRecords.FIELDS)
+        self.writer.writeheader()
+        self.file.flush()
+
+    def write(self, record: dict):
+        self.pending.append(record)
+        if len(self.pending) >= self.flush_rows:
+            self.flush()
+
+    def flush(self):
+        if self.pending:
+            self.writer.writerows(self.pending)
+            self.pending = []
+        self.file.flush()
+
+    def close(self):
+        if not self.file.closed:
+            self.flush()
+            self.file.close()
+
+
+def save_session_outputs(session_id: str, session: dict, records: SessionRecords, csv_out: CsvRecordWriter | None):
+    """Finish a session's exports: close the live CSV and write the .npz store.
+
+    Sessions scored in one pass have no live CSV; theirs is produced from
+    the .npz the first time it is downloaded.
+    """
+    if csv_out is not None:
+        csv_out.close()
     if not records:
-        return summary
+        if csv_out is not None:
+            os.remove(csv_out.path)
+        session['csv_path'] = None
+        return
+    npz_path = session_output_path(session_id, 'npz')
+    os.makedirs(os.path.dirname(npz_path), exist_ok=True)
+    records.to_npz(npz_path)
+    session['npz_path'] = npz_path
+    session['csv_path'] = csv_out.path if csv_out is not None else session_output_path(session_id, 'csv')
+
+
+def landmarks_to_array(pose_landmarks) -> np.ndarray:
+    """Convert MediaPipe pose landmarks to a ``(33, 4)`` float32 array of x, y, z, visibility"""
+    return np.fromiter(
+        (v for lm in pose_landmarks.landmark for v in (lm.x, lm.y, lm.z, lm.visibility)),
+        dtype=np.float32, count=33 * 4,
+    ).reshape(33, 4)
+
+
+def pose_features(coords) -> dict:
+    """Angles and positions the exercise rules look at, for a ``(frames, 33, >=2)`` stack.
+
+    Returns a dict of float32 arrays, one value per frame.
+    """
+    coords = np.asarray(coords, dtype=np.float32)
+    angles = joint_angles(coords)
+    return {
+        'elbow_angle': angles[:, JOINT_NAMES.index('elbow_l')],
+        'hip_angle': angles[:, JOINT_NAMES.index('hip_l')],
+        'feet_apart': np.abs(coords[:, 27, 0] - coords[:, 28, 0]),
+        # how far the lower of the two wrists is above its shoulder (image y grows downwards)
+        'wrist_rise': np.minimum(coords[:, 11, 1] - coords[:, 15, 1], coords[:, 12, 1] - coords[:, 16, 1]),
+    }
+
+
+def feature_row(features: dict, i: int) -> dict:
+    """One frame of a ``pose_features`` result as plain floats"""
+    return {name: float(values[i]) for name, values in features.items()}
+
+
+# Exercise definitions. Each rule is data only and is run by the same engine
+# frame-by-frame (live analysis) or over whole feature arrays (re-scoring):
+#   params         named thresholds, overridable when re-scoring a session
+#   initial_stage  stage before the first transition
+#   enter          (stage, conditions): switch to this stage whenever the conditions hold
+#   count          (stage, conditions): from the ``enter`` stage, count a rep and switch
+#   timer          conditions under which ``count`` is the seconds since the first frame
+#   feedback       ordered (conditions, text); the first match wins
+#   simple_interval  frames per rep in the basic (no MediaPipe) mode
+# A condition is (feature, op, value) where value is a number, a param name
+# or a stage name, or ('not', [conditions]). Features are those returned by
+# pose_features() plus 'stage'.
+EXERCISES = {
+    'pushup': {
+        'name': 'push-up',
+        'label': 'Reps',
+        'params': {'bottom_elbow': 90, 'lower_elbow': 100, 'top_elbow': 160, 'straight_hip': 160},
+        'initial_stage': 'up',
+        'enter': ('down', [('elbow_angle', '<=', 'bottom_elbow'), ('hip_angle', '>', 'straight_hip')]),
+        'count': ('up', [('elbow_angle', '>=', 'top_elbow'), ('hip_angle', '>', 'straight_hip')]),
+        'feedback': [
+            ([('hip_angle', '<', 'straight_hip')], "Keep your hips straight!"),
+            ([('elbow_angle', '>', 'lower_elbow'), ('stage', '==', 'down')], "Go lower!"),
+            ([], "Good form!"),
+        ],
+        'simple_interval': 45,
+    },
+    'pullup': {
+        # Down (bottom) ~ elbow extended; Up (top) ~ elbow flexed
+        'name': 'pull-up',
+        'label': 'Reps',
+        'params': {'hang_elbow': 150, 'full_hang_elbow': 160, 'top_elbow': 70, 'strong_elbow': 60},
+        'initial_stage': 'up',
+        'enter': ('down', [('elbow_angle', '>=', 'hang_elbow')]),
+        'count': ('up', [('elbow_angle', '<=', 'top_elbow')]),
+        'feedback': [
+            ([('elbow_angle', '>', 'full_hang_elbow')], "Fully hang before pulling."),
+            ([('elbow_angle', '<', 'strong_elbow')], "Strong pull! Control the descent."),
+            ([], "Keep pulling vertically."),
+        ],
+        'simple_interval': 60,
+    },
+    'situp': {
+        # Hip angle closing detects the up position
+        'name': 'sit-up',
+        'label': 'Reps',
+        'params': {'flat_hip': 150, 'very_flat_hip': 170, 'top_hip': 100, 'high_hip': 90},
+        'initial_stage': 'up',
+        'enter': ('down', [('hip_angle', '>=', 'flat_hip')]),
+        'count': ('up', [('hip_angle', '<=', 'top_hip')]),
+        'feedback': [
+            ([('hip_angle', '>', 'very_flat_hip')], "Start from flat back."),
+            ([('hip_angle', '<', 'high_hip')], "Good sit-up height."),
+            ([], "Curl up smoothly; avoid neck strain."),
+        ],
+        'simple_interval': 40,
+    },
+    'jumping_jack': {
+        # "open" when feet apart and hands high; "closed" when feet together and hands low
+        'name': 'jumping jack',
+        'label': 'Reps',
+        'params': {'wide_feet': 0.35, 'hands_high': 0.1},
+        'initial_stage': 'up',
+        'enter': ('open', [('feet_apart', '>', 'wide_feet'), ('wrist_rise', '>', 'hands_high')]),
+        'count': ('closed', [('not', [('feet_apart', '>', 'wide_feet'), ('wrist_rise', '>', 'hands_high')])]),
+        'feedback': [
+            ([('feet_apart', '>', 'wide_feet'), ('wrist_rise', '>', 'hands_high')], "Arms overhead, feet wide"),
+            ([], "Return to start position"),
+        ],
+        'simple_interval': 30,
+    },
+    'plank': {
+        # Count seconds of good plank (hip straight)
+        'name': 'plank',
+        'label': 'Secs',
+        'params': {'straight_hip': 165},
+        'initial_stage': 'up',
+        'timer': [('hip_angle', '>', 'straight_hip')],
+        'feedback': [
+            ([('hip_angle', '>', 'straight_hip')], "Hips level"),
+            ([], "Lift hips to neutral"),
+        ],
+        'simple_interval': 30,
+    },
+}
+
+_CONDITION_OPS = {
+    '<': operator.lt, '<=': operator.le, '>': operator.gt,
+    '>=': operator.ge, '==': operator.eq, '!=': operator.ne,
+}
+
+
+def get_exercise(exercise: str) -> dict:
+    """Rule for an exercise; unknown names use the push-up rule"""
+    return EXERCISES.get(exercise, EXERCISES['pushup'])
+
+
+def check_conditions(conditions, values: dict, params: dict):
+    """AND of ``conditions``; works on scalars (live) and NumPy arrays (batch) alike"""
+    result = True
+    for condition in conditions:
+        if condition[0] == 'not':
+            ok = np.logical_not(check_conditions(condition[1], values, params))
+        else:
+            feature, op, value = condition
+            if isinstance(value, str):
+                value = params.get(value, value)
+            ok = _CONDITION_OPS[op](values[feature], value)
+        result = np.logical_and(result, ok)
+    return result
+
+
+def _iter_conditions(conditions):
+    for condition in conditions:
+        if condition[0] == 'not':
+            yield from _iter_conditions(condition[1])
+        else:
+            yield condition
+
+
+def exercise_thresholds(rule: dict, params: dict) -> dict:
+    """Numeric thresholds per feature in a rule, e.g. ``{'elbow_angle': (90, 160)}``"""
+    conditions = list(rule.get('timer', []))
+    for key in ('enter', 'count'):
+        if key in rule:
+            conditions += rule[key][1]
+    for feedback_conditions, _ in rule['feedback']:
+        conditions += feedback_conditions
+    thresholds = {}
+    for feature, _, value in _iter_conditions(conditions):
+        if feature == 'stage':
+            continue
+        value = params.get(value, value) if isinstance(value, str) else value
+        if value not in thresholds.setdefault(feature, ()):
+            thresholds[feature] += (value,)
+    return thresholds
+
+
+def new_rep_state(exercise: str, overrides: dict | None = None) -> dict:
+    """Initial live rep-counting state for an exercise, with optional threshold overrides"""
+    rule = get_exercise(exercise)
+    params = dict(rule['params'])
+    params.update(overrides or {})
+    return {
+        'rule': rule, 'params': params,
+        'count': 0, 'stage': rule['initial_stage'], 'feedback': "", 'start_ms': None,
+    }
+
+
+def update_rep_state(state: dict, features: dict, timestamp_ms):
+    """Advance the stage/count/feedback state by one frame using its exercise rule"""
+    rule, params = state['rule'], state['params']
+    if state['start_ms'] is None and timestamp_ms is not None:
+        state['start_ms'] = timestamp_ms
+    values = dict(features, stage=state['stage'])
+
+    if 'timer' in rule:
+        if (check_conditions(rule['timer'], values, params)
+                and timestamp_ms is not None and state['start_ms'] is not None):
+            state['count'] = int(max(0, (timestamp_ms - state['start_ms']) / 1000.0))
+    else:
+        enter_stage, enter_conditions = rule['enter']
+        count_stage, count_conditions = rule['count']
+        if check_conditions(enter_conditions, values, params):
+            state['stage'] = values['stage'] = enter_stage
+        if state['stage'] == enter_stage and check_conditions(count_conditions, values, params):
+            state['count'] += 1
+            state['stage'] = values['stage'] = count_stage
+
+    for conditions, text in rule['feedback']:
+        if check_conditions(conditions, values, params):
+            state['feedback'] = text
+            break
+
+
+def score_series(exercise: str, features: dict, timestamps, overrides: dict | None = None) -> dict:
+    """Run an exercise rule over whole feature arrays in one vectorized pass.
+
+    Gives the same stage/count/feedback per frame as calling
+    ``update_rep_state`` frame by frame, as arrays.
+    """
+    rule = get_exercise(exercise)
+    params = dict(rule['params'])
+    params.update(overrides or {})
+    timestamps = np.asarray(timestamps, dtype=np.float64)
+    n = len(timestamps)
+    if n == 0:
+        return {'stage': np.array([], dtype=str), 'count': np.array([], dtype=np.int64),
+                'feedback': np.array([], dtype=object)}
+    positions = np.arange(n)
+
+    def mask(conditions, values):
+        return np.broadcast_to(np.asarray(check_conditions(conditions, values, params), dtype=bool), (n,))
+
+    if 'timer' in rule:
+        stage = np.full(n, rule['initial_stage'])
+        seconds = np.floor(np.maximum(0.0, (timestamps - timestamps[0]) / 1000.0))
+        # the count holds its last value while the timer condition is not met
+        last = np.maximum.accumulate(np.where(mask(rule['timer'], features), positions, -1))
+        count = np.where(last >= 0, seconds[np.maximum(last, 0)], 0).astype(np.int64)
+    else:
+        enter_stage, enter_conditions = rule['enter']
+        count_stage, count_conditions = rule['count']
+        entering = mask(enter_conditions, features)
+        counting = mask(count_conditions, features)
+        # 1 = enters the first stage, 2 = count condition holds. A 2 is a rep only if the
+        # stage was the first one: the previous event was a 1, or it also enters this frame.
+        code = np.where(counting, 2, np.where(entering, 1, 0))
+        events = np.flatnonzero(code)
+        previous_code = np.empty(len(events), dtype=code.dtype)
+        if len(events):
+            previous_code[0] = 1 if rule['initial_stage'] == enter_stage else 0
+            previous_code[1:] = code[events[:-1]]
+        reps = np.zeros(n, dtype=bool)
+        reps[events] = (code[events] == 2) & ((previous_code == 1) | entering[events])
+        effective = np.where(reps, 2, np.where(code == 1, 1, 0))
+        last = np.maximum.accumulate(np.where(effective > 0, positions, 0))
+        stage = np.array([rule['initial_stage'], enter_stage, count_stage])[effective[last]]
+        count = np.cumsum(reps)
+
+    values = dict(features, stage=stage)
+    feedback = np.full(n, "", dtype=object)
+    remaining = np.ones(n, dtype=bool)
+    for conditions, text in rule['feedback']:
+        hit = remaining & mask(conditions, values)
+        feedback[hit] = text
+        remaining &= ~hit
+    return {'stage': stage, 'count': count, 'feedback': feedback}
+
+
+def make_rep_record(state: dict, frame_index: int, timestamp_ms, features: dict) -> dict:
+    """Advance the rep state with one frame's features and return its session record"""
+    update_rep_state(state, features, timestamp_ms)
+    return {
+        "frame": frame_index,
+        "timestamp_ms": float(timestamp_ms) if timestamp_ms is not None else 0.0,
+        "elbow_angle": float(features['elbow_angle']),
+        "hip_angle": float(features['hip_angle']),
+        "stage": state['stage'],
+        "count": int(state['count']),
+        "feedback": state['feedback'],
+    }
+
+
+def analyze_landmark_series(exercise: str, landmarks: 'LandmarkBuffer', overrides: dict | None = None) -> SessionRecords:
+    """Re-score stored landmarks without touching the video, in one vectorized pass"""
+    data = landmarks.arrays()
+    features = pose_features(data['coords'])
+    scored = score_series(exercise, features, data['timestamps'], overrides)
+    records = SessionRecords()
+    records.extend_columns({
+        'frame': data['frames'],
+        'timestamp_ms': data['timestamps'],
+        'elbow_angle': features['elbow_angle'],
+        'hip_angle': features['hip_angle'],
+        'stage': scored['stage'],
+        'count': scored['count'],
+        'feedback': scored['feedback'],
+    })
+    return records
+
+
+# Distance from a threshold (degrees for angles, normalised units otherwise) that counts as "near"
+THRESHOLD_MARGINS = {'elbow_angle': 15.0, 'hip_angle': 15.0, 'feet_apart': 0.05, 'wrist_rise': 0.05}
+
+# Target pose inference rate in Hz; 0 runs inference on every decoded frame.
+# Can be overridden per upload with the ``sample_rate`` form field.
+SAMPLE_RATE_HZ = float(os.environ.get('SAMPLE_RATE_HZ', 0))
+
+
+def sampling_stride(fps: float, sample_rate: float) -> int:
+    """Frames per inference sample away from stage thresholds (1: every frame)"""
+    return max(1, int(round((fps or 30.0) / sample_rate))) if sample_rate else 1
+
+
+def parse_sample_rate(value, default: float = SAMPLE_RATE_HZ) -> float:
+    """Validate a requested sampling rate in Hz (0 disables sampling)"""
+    try:
+        rate = float(value)
+    except (TypeError, ValueError):
+        return default
+    return max(rate, 0.0)
+
+
+def near_stage_threshold(thresholds: dict, features: dict, previous: dict | None) -> bool:
+    """True when the next sample could cross one of an exercise's ``thresholds``.
+
+    The margin grows with how fast the feature moved since the previous
+    sample, so quick reps switch to full rate earlier.
+    """
+    for name, values in thresholds.items():
+        value = features[name]
+        margin = THRESHOLD_MARGINS.get(name, 0.0)
+        if previous is not None:
+            margin = max(margin, abs(value - previous[name]))
+        if any(abs(value - t) <= margin for t in values):
+            return True
+    return False
+
+
+def draw_pose(image, coords, visibility, min_visibility: float = 0.5):
+    """Draw a pose skeleton from normalised landmark coordinates onto a BGR image"""
+    h, w = image.shape[:2]
+    xy = np.asarray(coords)[:, :2]
+    shown = (np.asarray(visibility) >= min_visibility) & (xy >= 0).all(axis=1) & (xy <= 1).all(axis=1)
+    points = np.minimum(np.floor(xy * (w, h)), (w - 1, h - 1)).astype(int)
+    for a, b in mp_pose.POSE_CONNECTIONS:
+        if shown[a] and shown[b]:
+            cv2.line(image, tuple(points[a]), tuple(points[b]), (224, 224, 224), 2)
+    for i in np.flatnonzero(shown):
+        cv2.circle(image, tuple(points[i]), 2, (0, 0, 255), 2)
+
+
+def draw_overlay(image, exercise: str, record: dict, coords, visibility):
+    """Draw the rep counter, feedback, angles and skeleton for one analysed frame"""
+    label = get_exercise(exercise)['label']
+    cv2.putText(image, f"{label}: {record['count']}", (20, 40),
+                cv2.FONT_HERSHEY_SIMPLEX, 1, (0, 255, 0), 2, cv2.LINE_AA)
+    cv2.putText(image, f"Feedback: {record['feedback']}", (20, 80),
+                cv2.FONT_HERSHEY_SIMPLEX, 0.9, (0, 0, 255), 2, cv2.LINE_AA)
+    cv2.putText(image, f"Elbow: {int(record['elbow_angle'])}", (20, 120),
+                cv2.FONT_HERSHEY_SIMPLEX, 0.7, (255, 255, 0), 2, cv2.LINE_AA)
+    cv2.putText(image, f"Hip: {int(record['hip_angle'])}", (20, 150),
+                cv2.FONT_HERSHEY_SIMPLEX, 0.7, (255, 255, 0), 2, cv2.LINE_AA)
+    draw_pose(image, coords, visibility)
+
+
+def annotated_frames(video_path: str, exercise: str, landmarks: LandmarkBuffer, records: SessionRecords):
+    """Decode a video and yield ``(timestamp_ms, image)`` annotated from stored landmarks (no pose inference)"""
+    data = landmarks.arrays()
+    rows = {int(frame): i for i, frame in enumerate(data['frames'])}
+    by_frame = {int(frame): i for i, frame in enumerate(records.column('frame'))}
+    cap = cv2.VideoCapture(video_path)
+    try:
+        while cap.isOpened():
+            ret, frame = cap.read()
+            if not ret:
+                break
+            frame_index = int(cap.get(cv2.CAP_PROP_POS_FRAMES))
+            timestamp_ms = cap.get(cv2.CAP_PROP_POS_MSEC)
+            i = rows.get(frame_index)
+            if i is not None and frame_index in by_frame:
+                draw_overlay(frame, exercise, records[by_frame[frame_index]], data['coords'][i], data['visibility'][i])
+            yield timestamp_ms, frame
+    finally:
+        cap.release()
+
+
+def basic_annotated_frames(video_path: str, exercise: str, records: SessionRecords):
+    """Decode a video and yield ``(timestamp_ms, image)`` with the basic mode overlay of its records"""
+    counts = dict(zip(records.column('frame').astype(int).tolist(), records.column('count').astype(int).tolist()))
+    cap = cv2.VideoCapture(video_path)
+    try:
+        while cap.isOpened():
+            ret, frame = cap.read()
+            if not ret:
+                break
+            count = counts.get(int(cap.get(cv2.CAP_PROP_POS_FRAMES)))
+            if count is not None:
+                draw_basic_overlay(frame, exercise, count)
+            yield cap.get(cv2.CAP_PROP_POS_MSEC), frame
+    finally:
+        cap.release()
+
+
+def replayable(session: dict) -> bool:
+    """Whether a finished session's annotated frames can be drawn again from what it stored"""
+    return (bool(session.get('records')) and bool(session.get('video_path'))
+            and (session.get('landmarks') is not None or bool(session.get('basic_mode'))))
+
+
+def replay_frames(session: dict):
+    """A ``replayable`` session's ``(timestamp_ms, image)`` frames, from its landmarks or basic mode records"""
+    exercise = session.get('exercise', 'pushup')
+    if session.get('landmarks') is not None:
+        return annotated_frames(session['video_path'], exercise, session['landmarks'], session['records'])
+    return basic_annotated_frames(session['video_path'], exercise, session['records'])
+
+
+def render_replay_frames(session: dict):
+    """Like ``replay_frames`` but yields ``(timestamp_ms, jpeg)``"""
+    for timestamp_ms, frame in replay_frames(session):
+        ret2, buffer = cv2.imencode('.jpg', frame, [cv2.IMWRITE_JPEG_QUALITY, JPEG_QUALITY])
+        if ret2:
+            yield timestamp_ms, buffer.tobytes()
+
+
+# Annotated replay video written once per session. Tried in order as fourcc:extension;
+# browsers play avc1 (H.264) and VP8, pip builds of OpenCV usually only ship the latter two.
+VIDEO_CODECS = [tuple(item.split(':')) for item in
+                os.environ.get('VIDEO_CODECS', 'avc1:mp4,VP80:webm,mp4v:mp4').split(',') if ':' in item]
+# Render the replay as soon as a session finishes (headless API sessions render on first request).
+RENDER_VIDEO = os.environ.get('RENDER_VIDEO', '1') == '1'
+VIDEO_MIMETYPES = {'mp4': 'video/mp4', 'webm': 'video/webm'}
+
+
+def open_video_writer(base_path: str, fps: float, size: tuple):
+    """First ``cv2.VideoWriter`` from ``VIDEO_CODECS`` that opens; returns ``(writer, path)``"""
+    for fourcc, ext in VIDEO_CODECS:
+        path = f'{base_path}.{ext}'
+        writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*fourcc), fps, size)
+        if writer.isOpened():
+            return writer, path
+        writer.release()
+        if os.path.exists(path):
+            os.remove(path)
+    return None, None
+
+
+def render_session_video(session_id: str):
+    """Write a session's annotated replay to disk once, from its stored landmarks (or basic mode records)"""
+    session = sessions.get(session_id)
+    if not session:
+        return
+    with _render_lock:
+        if session.get('video_state') in ('rendering', 'ready') or not sessions.claim_render(session_id, session):
+            return
+        session['video_state'] = 'rendering'
+    writer = None
+    path = None
+    try:
+        if not replayable(session):
+            raise ValueError('no landmarks to render')
+        probe = cv2.VideoCapture(session['video_path'])
+        fps = probe.get(cv2.CAP_PROP_FPS) or 30.0
+        probe.release()
+        os.makedirs(SESSION_OUTPUT_DIR, exist_ok=True)
+        tmp_base = session_output_path(session_id, f'tmp-{uuid.uuid4().hex}')
+        for _, frame in replay_frames(session):
+            if writer is None:
+                writer, path = open_video_writer(tmp_base, fps, (frame.shape[1], frame.shape[0]))
+                if writer is None:
+                    raise RuntimeError('no usable video codec')
+            writer.write(frame)
+        if writer is None:
+            raise ValueError('video has no frames')
+        writer.release()
+        writer = None
+        final_path = session_output_path(session_id, path.rsplit('.', 1)[1])
+        os.replace(path, final_path)
+        session['video_export'] = final_path
+        session['video_state'] = 'ready'
+    except Exception as e:
+        print(f"Could not render replay video for {session_id}: {e}")
+        session['video_state'] = 'failed'
+        if writer is not None:
+            writer.release()
+            writer = None
+        if path and os.path.exists(path):
+            os.remove(path)
+    finally:
+        if writer is not None:
+            writer.release()
+    sessions.save_video_state(session_id, session)
+
+
+_render_lock = threading.Lock()
+
+
+def start_video_render(session_id: str):
+    """Render a session's replay video in the background unless it is already rendering or done"""
+    session = sessions.get(session_id)
+    if not session or session.get('video_state') in ('rendering', 'ready'):
+        return
+    threading.Thread(target=render_session_video, args=(session_id,),
+                     name=f'render-{session_id[:8]}', daemon=True).start()
+
+
+# Bounded queue depths of the per-frame pipeline: decoded frames waiting for
+# inference, and inferred frames waiting to be drawn and encoded. 0 runs that
+# stage inline on the caller's thread instead.
+PIPELINE_DECODE_DEPTH = int(os.environ.get('PIPELINE_DECODE_DEPTH', 4))
+PIPELINE_RENDER_DEPTH = int(os.environ.get('PIPELINE_RENDER_DEPTH', 2))
+
+
+def pipeline_stage(iterable, depth: int, name: str = 'pipeline'):
+    """Run ``iterable`` on its own thread and yield its items through a bounded queue.
+
+    OpenCV and MediaPipe release the GIL, so chained stages overlap decode,
+    inference and encoding. Errors are re-raised on the consuming side, and
+    closing the consumer stops the stage and waits for its thread.
+    """
+    items = queue.Queue(maxsize=max(1, depth))
+    stop = threading.Event()
+    finished = object()
+
+    def put(entry):
+        while not stop.is_set():
+            try:
+                items.put(entry, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def run():
+        try:
+            for item in iterable:
+                if not put((None, item)):
+                    break
+        except Exception as e:
+            put((e, None))
+        finally:
+            if hasattr(iterable, 'close'):
+                iterable.close()
+            put((None, finished))
+
+    thread = threading.Thread(target=run, name=name, daemon=True)
+    thread.start()
+    try:
+        while True:
+            error, item = items.get()
+            if error is not None:
+                raise error
+            if item is finished:
+                return
+            yield item
+    finally:
+        stop.set()
+        thread.join()
+
+
+class PrefetchCapture:
+    """Decode stage: reads a capture ahead on a background thread.
+
+    Offers the subset of the ``cv2.VideoCapture`` interface the analysis
+    loops use, plus ``plan()``. Every frame is decoded ahead unless
+    ``sampled``: then the caller reads the first frame and announces each
+    next sample with ``plan()`` after reading one. Only samples are decoded;
+    the frames before them are grabbed on the background thread, which waits
+    for the next ``plan()`` once it reaches the announced sample. Position
+    properties describe the frame handed out last.
+    """
+
+    def __init__(self, cap, depth: int = PIPELINE_DECODE_DEPTH, sampled: bool = False):
+        self.cap = cap
+        self.fps = cap.get(cv2.CAP_PROP_FPS)
+        self.frame_count = cap.get(cv2.CAP_PROP_FRAME_COUNT)
+        self.position = (0, 0.0)
+        self.exhausted = False
+        self.handed_out = 0
+        self.next_sample = 1 if sampled else None  # number of the next frame the caller will read()
+        self.decoded = self.grabbed = 0
+        self.plan_cond = threading.Condition()
+        self.frames = pipeline_stage(self._decode(), depth, 'decode')
+
+    def _decode(self):
+        number = 0
+        while self.cap.isOpened():
+            number += 1
+            with self.plan_cond:
+                # past the announced sample it is unknown whether a frame is needed until plan() says so
+                self.plan_cond.wait_for(lambda: self.next_sample is None or number <= self.next_sample
+                                        or self.exhausted)
+                if self.exhausted:
+                    return
+                skip = self.next_sample is not None and number < self.next_sample
+            if skip:
+                if not self.cap.grab():
+                    return
+                self.grabbed += 1
+                frame = None
+            else:
+                ret, frame = self.cap.read()
+                if not ret:
+                    return
+                self.decoded += 1
+            yield int(self.cap.get(cv2.CAP_PROP_POS_FRAMES)), self.cap.get(cv2.CAP_PROP_POS_MSEC), frame
+
+    def plan(self, stride: int):
+        """Announce that the next frame to be read() is ``stride`` frames after the last one handed out"""
+        with self.plan_cond:
+            self.next_sample = self.handed_out + stride
+            self.plan_cond.notify_all()
+
+    def isOpened(self):
+        return not self.exhausted
+
+    def read(self):
+        try:
+            frame_index, timestamp_ms, frame = next(self.frames)
+        except StopIteration:
+            self.exhausted = True
+            return False, None
+        self.handed_out += 1
+        self.position = (frame_index, timestamp_ms)
+        return True, frame
+
+    def grab(self):
+        return self.read()[0]
+
+    def get(self, prop):
+        if prop == cv2.CAP_PROP_POS_FRAMES:
+            return self.position[0]
+        if prop == cv2.CAP_PROP_POS_MSEC:
+            return self.position[1]
+        if prop == cv2.CAP_PROP_FPS:
+            return self.fps
+        if prop == cv2.CAP_PROP_FRAME_COUNT:
+            return self.frame_count
+        return 0.0
+
+    def close(self):
+        """Stop the decode thread; the wrapped capture is left for its owner to release"""
+        with self.plan_cond:
+            self.exhausted = True
+            self.plan_cond.notify_all()
+        self.frames.close()
+
+
+# Decode in a separate process and hand frames over through a shared-memory
+# ring instead of a decode thread (PIPELINE_DECODE_DEPTH slots are decoded ahead).
+PIPELINE_DECODE_PROCESS = os.environ.get('PIPELINE_DECODE_PROCESS', '0') == '1'
+
+
+class SharedMemoryCapture:
+    """Decode stage in its own process, read through a ``SharedFrameRing``.
+
+    Same capture interface as ``PrefetchCapture``. Frames returned by
+    ``read()`` are views into the ring and stay valid for the next ``hold``
+    reads, which covers the frames still queued for drawing and encoding.
+    """
+
+    def __init__(self, video_path: str, start: int = 0, stop: int | None = None,
+                 depth: int = PIPELINE_DECODE_DEPTH, hold: int = PIPELINE_RENDER_DEPTH + 3):
+        probe = cv2.VideoCapture(video_path)
+        self.fps = probe.get(cv2.CAP_PROP_FPS)
+        self.frame_count = probe.get(cv2.CAP_PROP_FRAME_COUNT)
+        shape = (int(probe.get(cv2.CAP_PROP_FRAME_HEIGHT)), int(probe.get(cv2.CAP_PROP_FRAME_WIDTH)), 3)
+        probe.release()
+
+        ctx = multiprocessing.get_context('spawn')
+        self.hold = max(1, hold)
+        self.ring = SharedFrameRing(self.hold + max(1, depth), shape)
+        self.free = ctx.Queue()
+        self.ready = ctx.Queue()
+        for slot in range(self.ring.slots):
+            self.free.put(slot)
+        self.stop_event = ctx.Event()
+        self.held = []
+        self.position = (0, 0.0)
+        self.exhausted = False
+        self.process = ctx.Process(
+            target=decode_into_ring, name='decode',
+            args=(video_path, start, stop, self.ring.name, self.ring.slots, shape,
+                  self.free, self.ready, self.stop_event),
+            daemon=True,
+        )
+        self.process.start()
+
+    def isOpened(self):
+        return not self.exhausted
+
+    def read(self):
+        if self.exhausted:
+            return False, None
+        while True:
+            try:
+                item = self.ready.get(timeout=1.0)
+                break
+            except queue.Empty:
+                if not self.process.is_alive() and self.ready.empty():
+                    item = None
+                    break
+        if item is None:
+            self.exhausted = True
+            return False, None
+        slot, frame_index, timestamp_ms = item
+        self.held.append(slot)
+        if len(self.held) > self.hold:
+            self.free.put(self.held.pop(0))
+        self.position = (frame_index, timestamp_ms)
+        return True, self.ring.frames[slot]
+
+    def grab(self):
+        ret, _ = self.read()
+        if ret:
+            # nobody looks at a grabbed frame: its slot can be reused straight away
+            self.free.put(self.held.pop())
+        return ret
+
+    def get(self, prop):
+        if prop == cv2.CAP_PROP_POS_FRAMES:
+            return self.position[0]
+        if prop == cv2.CAP_PROP_POS_MSEC:
+            return self.position[1]
+        if prop == cv2.CAP_PROP_FPS:
+            return self.fps
+        if prop == cv2.CAP_PROP_FRAME_COUNT:
+            return self.frame_count
+        return 0.0
+
+    def release(self):
+        self.exhausted = True
+        self.stop_event.set()
+        self.process.join(timeout=5)
+        if self.process.is_alive():
+            self.process.terminate()
+        self.ring.close(unlink=True)
+
+
+# Chunked uploads are written to ``<video>.part`` and renamed when complete.
+# Decoding a partial MP4/MOV gives up if the upload stops growing this long.
+UPLOAD_STALL_TIMEOUT_S = float(os.environ.get('UPLOAD_STALL_TIMEOUT_S', 120))
+
+
+def mp4_boxes(path: str, size: int | None = None) -> dict:
+    """Top-level ISO-BMFF boxes of the first ``size`` bytes of a file as ``{type: (start, end)}``.
+
+    Stops at the first box whose header is not on disk yet; ``end`` is None
+    for a box that runs to the end of the file. Returns {} for other containers.
+    """
+    boxes = {}
+    size = os.path.getsize(path) if size is None else size
+    with open(path, 'rb') as f:
+        offset = 0
+        while offset + 8 <= size:
+            f.seek(offset)
+            header = f.read(16)
+            box_size, box_type = int.from_bytes(header[:4], 'big'), header[4:8]
+            if not offset and box_type != b'ftyp':
+                return {}
+            if box_size == 1:
+                if len(header) < 16:
+                    break
+                box_size = int.from_bytes(header[8:16], 'big')
+            if box_size == 0:
+                boxes.setdefault(box_type.decode('latin-1'), (offset, None))
+                break
+            if box_size < 8:
+                return {}
+            boxes.setdefault(box_type.decode('latin-1'), (offset, offset + box_size))
+            offset += box_size
+    return boxes
+
+
+def _child_boxes(data: bytes, start: int = 0, end: int | None = None):
+    end = len(data) if end is None else end
+    while start + 8 <= end:
+        size, box_type = int.from_bytes(data[start:start + 4], 'big'), data[start + 4:start + 8]
+        header = 8
+        if size == 1:
+            size, header = int.from_bytes(data[start + 8:start + 16], 'big'), 16
+        if size < header:
+            return
+        yield box_type, start + header, start + size
+        start += size
+
+
+def mp4_video_sample_ends(path: str, moov: tuple) -> np.ndarray | None:
+    """File offset just past each video sample (decode order), from the moov sample tables"""
+    with open(path, 'rb') as f:
+        f.seek(moov[0])
+        data = f.read(moov[1] - moov[0])
+    for box_type, start, end in _child_boxes(data, 8):
+        if box_type != b'trak':
+            continue
+        tables, is_video = {}, False
+        pending = [(start, end)]
+        while pending:
+            for child, cstart, cend in _child_boxes(data, *pending.pop()):
+                if child in (b'mdia', b'minf', b'stbl'):
+                    pending.append((cstart, cend))
+                elif child == b'hdlr':
+                    is_video = data[cstart + 8:cstart + 12] == b'vide'
+                elif child in (b'stsz', b'stsc', b'stco', b'co64'):
+                    tables[child] = data[cstart:cend]
+        if not is_video or b'stsz' not in tables or b'stsc' not in tables:
+            continue
+        stsz = tables[b'stsz']
+        count = int.from_bytes(stsz[8:12], 'big')
+        uniform = int.from_bytes(stsz[4:8], 'big')
+        sizes = (np.full(count, uniform, dtype=np.int64) if uniform
+                 else np.frombuffer(stsz, dtype='>u4', count=count, offset=12).astype(np.int64))
+        if b'co64' in tables:
+            chunk_offsets = np.frombuffer(tables[b'co64'], dtype='>u8', offset=8).astype(np.int64)
+        elif b'stco' in tables:
+            chunk_offsets = np.frombuffer(tables[b'stco'], dtype='>u4', offset=8).astype(np.int64)
+        else:
+            return None
+        entries = np.frombuffer(tables[b'stsc'], dtype='>u4', offset=8).reshape(-1, 3).astype(np.int64)
+        # samples per chunk, expanded from the (first_chunk, samples_per_chunk, _) runs
+        firsts = entries[:, 0] - 1
+        runs = np.diff(np.append(firsts, len(chunk_offsets)))
+        per_chunk = np.repeat(entries[:, 1], runs)
+        chunk_of_sample = np.repeat(np.arange(len(per_chunk)), per_chunk)[:count]
+        first_in_chunk = np.concatenate(([0], np.cumsum(per_chunk)[:-1]))
+        within = np.cumsum(sizes) - sizes - (np.cumsum(sizes) - sizes)[first_in_chunk[chunk_of_sample]]
+        return chunk_offsets[chunk_of_sample] + within + sizes
+    return None
+
+
+def streamable_prefix(boxes: dict, received: int) -> bool:
+    """True when a partial MP4 can be decoded from the front: its index (moov) is
+    fully received and comes before the media data"""
+    moov, mdat = boxes.get('moov'), boxes.get('mdat')
+    return (moov is not None and mdat is not None and mdat[1] is not None
+            and moov[1] <= received and moov[1] <= mdat[0])
+
+
+class GrowingFileCapture:
+    """Capture over a video that is still being uploaded to ``<video_path>.part``.
+
+    For an MP4/MOV with its index at the front, frame ``i`` is read once
+    the upload is past the end of its sample (and a few after it, for
+    reordered frames), located from the moov sample tables. Other files are
+    read once the upload completes. A decoder that still hits the end of the
+    data is reopened and seeked back to the next frame.
+    """
+
+    REORDER_FRAMES = 4
+
+    def __init__(self, video_path: str, poll_s: float = 0.2, stall_timeout: float = UPLOAD_STALL_TIMEOUT_S):
+        self.video_path = video_path
+        self.part_path = video_path + '.part'
+        self.poll_s = poll_s
+        self.stall_timeout = stall_timeout
+        self.position = 0
+        self.cap = None
+        self.sample_ends = None
+        self._reopen()
+
+    def _uploading(self) -> bool:
+        return os.path.exists(self.part_path) and not os.path.exists(self.video_path)
+
+    def _size(self) -> int:
+        for path in (self.video_path, self.part_path):
+            try:
+                return os.path.getsize(path)
+            except OSError:
+                continue
+        return 0
+
+    def _needed(self, frame_index: int) -> float:
+        if self.sample_ends is None or not len(self.sample_ends):
+            return float('inf')  # no sample table to go by: wait for the whole file
+        return self.sample_ends[min(frame_index + self.REORDER_FRAMES, len(self.sample_ends) - 1)]
+
+    def _wait_for(self, needed: float) -> bool:
+        """Block until ``needed`` bytes are on disk or the upload is complete; False if it stalled or vanished"""
+        last_size, last_change = -1, time.monotonic()
+        while self._uploading():
+            size = self._size()
+            if size >= needed:
+                return True
+            if size != last_size:
+                last_size, last_change = size, time.monotonic()
+            elif time.monotonic() - last_change > self.stall_timeout:
+                return False
+            time.sleep(self.poll_s)
+        return os.path.exists(self.video_path)
+
+    def _reopen(self):
+        while self.sample_ends is None and self._uploading():
+            size = self._size()
+            try:
+                boxes = mp4_boxes(self.part_path, size)
+                if streamable_prefix(boxes, size):
+                    ends = mp4_video_sample_ends(self.part_path, boxes['moov'])
+                    # samples are not always stored in decode order
+                    self.sample_ends = np.maximum.accumulate(ends) if ends is not None else np.zeros(0)
+                    break
+            except OSError:
+                continue  # renamed under us: the upload just completed
+            if (size >= 8 and not boxes) or 'mdat' in boxes:
+                # not an MP4 with its index in front: it can only be read whole
+                if not self._wait_for(float('inf')):
+                    return
+                break
+            if not self._wait_for(size + 1):
+                return
+        # opening probes the first frames, so let them arrive first
+        if not self._wait_for(self._needed(self.position)):
+            return
+        path = self.video_path if os.path.exists(self.video_path) else self.part_path
+        if self.cap is not None:
+            self.cap.release()
+        self.opened_size = self._size()
+        self.cap = cv2.VideoCapture(path)
+        if self.position:
+            self.cap.set(cv2.CAP_PROP_POS_FRAMES, self.position)
+
+    def _next(self, read: bool):
+        while self.cap is not None and self._wait_for(self._needed(self.position)):
+            ret, frame = self.cap.read() if read else (self.cap.grab(), None)
+            if ret:
+                self.position += 1
+                return ret, frame
+            if not self._uploading() and self.opened_size == self._size():
+                return False, None  # the complete file has been read to its end
+            # the decoder ran into the end of the data: wait for more and reopen there
+            if not self._wait_for(self.opened_size + 1):
+                return False, None
+            self._reopen()
+        return False, None
+
+    def isOpened(self):
+        return self.cap is not None and self.cap.isOpened()
+
+    def read(self):
+        return self._next(True)
+
+    def grab(self):
+        return self._next(False)[0]
+
+    def get(self, prop):
+        if prop == cv2.CAP_PROP_POS_FRAMES:
+            return float(self.position)
+        return self.cap.get(prop) if self.cap is not None else 0.0
+
+    def release(self):
+        if self.cap is not None:
+            self.cap.release()
+
+
+def open_video(video_path: str, start: int = 0, stop: int | None = None):
+    """Open a video (or a frame range of it) for analysis, decoding in another process if configured"""
+    if not os.path.exists(video_path) and os.path.exists(video_path + '.part'):
+        cap = GrowingFileCapture(video_path)
+        return FrameRangeCapture(cap, start, stop) if start or stop is not None else cap
+    if PIPELINE_DECODE_PROCESS:
+        return SharedMemoryCapture(video_path, start, stop)
+    cap = cv2.VideoCapture(video_path)
+    return FrameRangeCapture(cap, start, stop) if start or stop is not None else cap
+
+
+def analyze_pose_frames(cap, exercise: str, pose, options: dict | None = None,
+                        track: LandmarkBuffer | None = None, render=None):
+    """Run pose inference and rep counting over a capture.
+
+    Yields ``(record, frame_bytes)`` per frame; ``record`` is None for frames
+    without a detected pose and ``frame_bytes`` is None for frames that were
+    skipped by sampling. Does not touch ``sessions`` so it can run inside a
+    pool worker.
+
+    Inference runs on a copy downscaled to ``options['inference_size']``.
+    Landmarks are normalised to [0, 1], so angles are unaffected by the scale
+    and the overlay is drawn straight onto the full-resolution frame.
+
+    With ``options['sample_rate']`` set, only about that many frames per
+    second are decoded and sent to the model; the rest are skipped with
+    ``cap.grab()``. Their landmarks are interpolated between the surrounding
+    samples so the rep state machine still sees every frame. Near a stage
+    threshold every frame is sampled again.
+
+    When ``track`` is given, the landmarks behind every record are appended
+    to it so the session can be re-scored later without the video.
+
+    ``render`` is an optional callable checked per sampled frame; while it
+    returns False no overlay is drawn and nothing is JPEG-encoded.
+
+    Decode, inference and drawing/encoding run as pipeline stages on their
+    own threads, linked by queues of ``PIPELINE_DECODE_DEPTH`` and
+    ``PIPELINE_RENDER_DEPTH`` frames.
+    """
+    # a SharedMemoryCapture already decodes ahead in its own process
+    sampled = sampling_stride(cap.get(cv2.CAP_PROP_FPS), (options or {}).get('sample_rate', SAMPLE_RATE_HZ)) > 1
+    prefetch = (PrefetchCapture(cap, sampled=sampled)
+                if PIPELINE_DECODE_DEPTH > 0 and not isinstance(cap, SharedMemoryCapture) else None)
+    frames = _infer_pose_frames(prefetch or cap, exercise, pose, options, track, render)
+    if PIPELINE_RENDER_DEPTH > 0:
+        frames = pipeline_stage(frames, PIPELINE_RENDER_DEPTH, 'inference')
+    try:
+        for record, image, landmarks in frames:
+            if image is None:
+                yield record, None
+                continue
+            if landmarks is not None:
+                try:
+                    draw_overlay(image, exercise, record, landmarks[:, :3], landmarks[:, 3])
+                except Exception:
+                    pass
+            ret2, buffer = cv2.imencode('.jpg', image, [cv2.IMWRITE_JPEG_QUALITY, JPEG_QUALITY])
+            yield record, (buffer.tobytes() if ret2 else None)
+    finally:
+        frames.close()
+        if prefetch is not None:
+            prefetch.close()
+
+
+def _infer_pose_frames(cap, exercise: str, pose, options: dict | None, track: LandmarkBuffer | None, render):
+    """Inference stage of ``analyze_pose_frames``.
+
+    Yields ``(record, image, landmarks)``; ``image`` is the frame to render
+    (None if it is not to be rendered) and ``landmarks`` the pose to draw on it.
+    """
+    options = options or {}
+    inference_size = options.get('inference_size', INFERENCE_LONG_SIDE)
+    sample_rate = options.get('sample_rate', SAMPLE_RATE_HZ)
+    base_stride = sampling_stride(cap.get(cv2.CAP_PROP_FPS), sample_rate)
+    plan = getattr(cap, 'plan', None) if base_stride > 1 else None
+
+    state = new_rep_state(exercise)
+    thresholds = exercise_thresholds(state['rule'], state['params'])
+    stride = 1
+    skipped = []  # (frame_index, timestamp_ms) grabbed since the last sample
+    previous = None  # (frame_index, landmarks, features) of the last sample with a pose
+
+    def make_record(frame_index, timestamp_ms, features):
+        return make_rep_record(state, frame_index, timestamp_ms, features)
+
+    while cap.isOpened():
+        if len(skipped) < stride - 1:
+            if not cap.grab():
+                break
+            skipped.append((int(cap.get(cv2.CAP_PROP_POS_FRAMES)), cap.get(cv2.CAP_PROP_POS_MSEC)))
+            continue
+
+        ret, frame = cap.read()
+        if not ret:
+            break
+        current_frame_index = int(cap.get(cv2.CAP_PROP_POS_FRAMES))
+        current_timestamp_ms = cap.get(cv2.CAP_PROP_POS_MSEC)
+
+        rendering = render is None or render()
+        image = cv2.cvtColor(resize_for_inference(frame, inference_size), cv2.COLOR_BGR2RGB)
+        image.flags.writeable = False
+        results = pose.process(image)
+        image = frame
+
+        record = None
+        landmarks = None
+        try:
+            if results.pose_landmarks:
+                landmarks = landmarks_to_array(results.pose_landmarks)
+
+                if previous is not None and skipped:
+                    # Interpolate every skipped frame and score them with the current one in one batch
+                    prev_index, prev_landmarks, _ = previous
+                    indices = np.array([f for f, _ in skipped], dtype=np.float32)
+                    w = ((indices - prev_index) / float(current_frame_index - prev_index))[:, None, None]
+                    batch = np.concatenate([prev_landmarks + (landmarks - prev_landmarks) * w, landmarks[None]])
+                    batch_features = pose_features(batch)
+                    if track is not None:
+                        track.extend([f for f, _ in skipped], [t for _, t in skipped], batch[:-1])
+                    for i, (frame_index, timestamp_ms) in enumerate(skipped):
+                        yield make_record(frame_index, timestamp_ms, feature_row(batch_features, i)), None, None
+                    features = feature_row(batch_features, -1)
+                else:
+                    features = feature_row(pose_features(landmarks[None]), 0)
+                if track is not None:
+                    track.extend([current_frame_index], [current_timestamp_ms], landmarks[None])
+
+                stride = 1 if near_stage_threshold(
+                    thresholds, features, previous[2] if previous else None) else base_stride
+                previous = (current_frame_index, landmarks, features)
+
+                record = make_record(current_frame_index, current_timestamp_ms, features)
+            else:
+                previous = None
+                stride = 1
+        except Exception:
+            landmarks = None
+        skipped = []
+        if plan is not None:
+            plan(stride)
+
+        if not rendering:
+            yield record, None, None
+        else:
+            yield record, image, (landmarks if record is not None else None)
+
+    if previous is not None:
+        # Frames grabbed after the last sample have nothing to interpolate towards: hold the last pose
+        if track is not None and skipped:
+            held = np.repeat(previous[1][None], len(skipped), axis=0)
+            track.extend([f for f, _ in skipped], [t for _, t in skipped], held)
+        for frame_index, timestamp_ms in skipped:
+            yield make_record(frame_index, timestamp_ms, previous[2]), None, None
+
+
+# MediaPipe Pose construction arguments; part of the landmark cache key.
+POSE_SETTINGS = {'min_detection_confidence': 0.5, 'min_tracking_confidence': 0.5}
+
+
+# Pose worker pool: each worker process keeps one warm MediaPipe Pose graph
+# for its whole lifetime and resets it between sessions.
+ANALYSIS_WORKERS = int(os.environ.get(
+    'ANALYSIS_WORKERS',
+    max(1, (os.cpu_count() or 1) // max(1, int(os.environ.get('WEB_CONCURRENCY', 1))))
+))
+
+_worker_pose = None
+_worker_events = None
+_worker_render_flags = None
+_pose_pool = None
+_pose_pool_lock = threading.Lock()
+
+# Render flag values of a pool task's slot
+RENDER_OFF, RENDER_ON, RENDER_STOP = 0, 1, -1
+
+
+def _init_pose_worker(events=None, render_flags=None):
+    """Pool initializer: build the Pose graph once and warm it up"""
+    global _worker_pose, _worker_events, _worker_render_flags
+    _worker_events, _worker_render_flags = events, render_flags
+    _worker_pose = mp_pose.Pose(**POSE_SETTINGS)
+    _worker_pose.process(np.zeros((256, 256, 3), dtype=np.uint8))
+    _worker_pose.reset()
+
+
+def _pose_worker_analyze(video_path: str, exercise: str, options: dict, slot: int) -> dict:
+    """Pool task: analyze one video with the worker's warm Pose, streaming ``(slot, result)`` to the events queue.
+
+    Frames are only rendered while the slot's render flag is on, and the task
+    stops early once it is set to ``RENDER_STOP``. Returns the landmark arrays
+    of the whole video once it is done.
+    """
+    _worker_pose.reset()
+    cap = open_video(video_path)
+    track = LandmarkBuffer(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+    try:
+        for record, frame_bytes in analyze_pose_frames(cap, exercise, _worker_pose, options, track,
+                                                       render=lambda: _worker_render_flags[slot] == RENDER_ON):
+            if _worker_render_flags[slot] == RENDER_STOP:
+                break
+            _worker_events.put((slot, (record, frame_bytes)))
+    finally:
+        cap.release()
+        _worker_events.put((slot, None))
+    return track.arrays()
+
+
+class PosePool:
+    """Pose worker processes sharing one results queue.
+
+    Each running video task holds a slot: a byte of shared memory with its
+    render flag, and a local queue the results of that slot are routed to
+    by a thread of this process. A slot is reused only after its task's end
+    marker came through.
+    """
+
+    def __init__(self, workers: int, slots: int):
+        # spawn, not fork: the web process has live threads and MediaPipe state
+        ctx = multiprocessing.get_context('spawn')
+        self.events = ctx.Queue()
+        self.render_flags = ctx.RawArray('b', slots)
+        self.executor = ProcessPoolExecutor(max_workers=workers, mp_context=ctx, initializer=_init_pose_worker,
+                                            initargs=(self.events, self.render_flags))
+        self.free = list(range(slots))
+        self.channels = {}
+        self._lock = threading.Lock()
+        threading.Thread(target=self._route, name='pose-events', daemon=True).start()
+
+    def _route(self):
+        while True:
+            item = self.events.get()
+            if item is None:
+                return
+            slot, result = item
+            with self._lock:
+                channel = self.channels.get(slot)
+                if result is None:
+                    self.channels.pop(slot, None)
+                    self.free.append(slot)
+            if channel is not None:
+                channel.put(result)
+
+    def open_slot(self, rendering: bool):
+        """Reserve a slot; returns ``(slot, results queue)``, or None if every slot is taken"""
+        with self._lock:
+            if not self.free:
+                return None
+            slot = self.free.pop()
+            channel = self.channels[slot] = queue.Queue()
+        self.render_flags[slot] = RENDER_ON if rendering else RENDER_OFF
+        return slot, channel
+
+    def stop_slot(self, slot: int, channel):
+        """Ask a slot's task to stop, unless it already ended and the slot went to another task"""
+        with self._lock:
+            if self.channels.get(slot) is channel:
+                self.render_flags[slot] = RENDER_STOP
+
+    def submit(self, fn, *args):
+        return self.executor.submit(fn, *args)
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
+        self.events.put(None)
+
+
+def get_pose_pool() -> PosePool | None:
+    """Lazily create the pose worker pool (after gunicorn has forked its workers)"""
+    global _pose_pool
+    if ANALYSIS_WORKERS <= 0 or not MEDIAPIPE_AVAILABLE:
+        return None
+    with _pose_pool_lock:
+        if _pose_pool is None:
+            _pose_pool = PosePool(ANALYSIS_WORKERS, max(64, 8 * ANALYSIS_WORKERS))
+    return _pose_pool
+
+
+def discard_pose_pool(pool: PosePool):
+    """Drop a pool whose worker died (BrokenProcessPool); the next analysis starts a fresh one"""
+    global _pose_pool
+    with _pose_pool_lock:
+        if _pose_pool is pool:
+            _pose_pool = None
+    print("Pose worker pool broke; starting a new one for the next analysis")
+    pool.shutdown()
+
+
+def iter_pose_results(video_path: str, exercise: str, options: dict | None = None,
+                      track: LandmarkBuffer | None = None, render=None):
+    """Yield ``(record, frame_bytes)`` for a video, using the worker pool when available.
+
+    Per-frame landmarks are collected into ``track`` if one is given, and
+    annotated frames are only produced while ``render()`` is true.
+    """
+    pool = get_pose_pool()
+    rendering = render is None or render()
+    reserved = pool.open_slot(rendering) if pool is not None else None
+    future = None
+    if reserved is not None:
+        slot, results = reserved
+        try:
+            future = pool.submit(_pose_worker_analyze, video_path, exercise, options or {}, slot)
+        except BrokenProcessPool:
+            discard_pose_pool(pool)
+    if future is None:
+        yield from _iter_pose_results_inline(video_path, exercise, options, track, render)
+        return
+
+    yielded = False
+    try:
+        while True:
+            if render is not None and render() != rendering:
+                rendering = not rendering
+                pool.render_flags[slot] = RENDER_ON if rendering else RENDER_OFF
+            try:
+                item = results.get(timeout=1.0)
+            except queue.Empty:
+                if future.done():
+                    future.result()  # re-raise a worker failure
+                    return
+                continue
+            if item is None:
+                break
+            yielded = True
+            yield item
+        arrays = future.result()
+    except BrokenProcessPool:
+        discard_pose_pool(pool)
+        if yielded:
+            raise
+        arrays = None
+    finally:
+        pool.stop_slot(slot, results)  # a no-op once the task has ended
+    if arrays is None:
+        # the worker died before sending anything: run this video here instead
+        yield from _iter_pose_results_inline(video_path, exercise, options, track, render)
+    elif track is not None:
+        track.extend_arrays(arrays)
+
+
+def _iter_pose_results_inline(video_path: str, exercise: str, options: dict | None, track: LandmarkBuffer | None, render):
+    pose = mp_pose.Pose(**POSE_SETTINGS)
+    cap = open_video(video_path)
+    try:
+        yield from analyze_pose_frames(cap, exercise, pose, options, track, render)
+    finally:
+        cap.release()
+        pose.close()
+
+
+# Offline jobs on videos at least two segments long are split into segments
+# of this many seconds and analysed in parallel across the pose workers.
+SEGMENT_SECONDS = float(os.environ.get('SEGMENT_SECONDS', 30))
+
+
+def _pose_worker_segment(video_path: str, exercise: str, options: dict, start: int, stop: int | None) -> dict:
+    """Pool task: landmarks of frames ``[start, stop)`` of a video, with nothing rendered"""
+    _worker_pose.reset()
+    cap = open_video(video_path, start, stop)
+    track = LandmarkBuffer((stop or 0) - start)
+    try:
+        for _ in analyze_pose_frames(cap, exercise, _worker_pose, options, track, render=lambda: False):
+            pass
+    finally:
+        cap.release()
+    return track.arrays()
+
+
+def analyze_video_segments(video_path: str, exercise: str, options: dict | None = None) -> LandmarkBuffer | None:
+    """Run pose inference over time segments of a video in parallel and stitch the landmarks.
+
+    Returns None when the video is too short or there is no pool to spread
+    it over; the caller then analyses it in one pass. Rep state is not
+    carried across segments here: the merged series is scored once
+    afterwards, so reps spanning a boundary count like any other.
+    """
+    pool = get_pose_pool()
+    if pool is None or ANALYSIS_WORKERS < 2:
+        return None
+    cap = cv2.VideoCapture(video_path)
+    total = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+    fps = cap.get(cv2.CAP_PROP_FPS) or 30.0
+    cap.release()
+    length = max(1, int(SEGMENT_SECONDS * fps))
+    if total < 2 * length:
+        return None
+
+    starts = list(range(0, total, length))
+    # the frame count in the header is an estimate: the last segment reads to the real end
+    stops = starts[1:] + [None]
+    track = LandmarkBuffer(total)
+    try:
+        futures = [pool.submit(_pose_worker_segment, video_path, exercise, options or {}, start, stop)
+                   for start, stop in zip(starts, stops)]
+        for future in futures:
+            track.extend_arrays(future.result())
+    except BrokenProcessPool:
+        discard_pose_pool(pool)
+        return None  # analysed in one pass instead
+    return track
+
+
+# Raw per-frame landmarks of analysed videos, keyed by video content and pose settings.
+LANDMARK_CACHE_DIR = os.environ.get('LANDMARK_CACHE_DIR', os.path.join('cache', 'landmarks'))
+# Least recently used entries are deleted once the cache grows past this size; 0 never evicts.
+LANDMARK_CACHE_MB = float(os.environ.get('LANDMARK_CACHE_MB', 1024))
+LANDMARK_ARRAYS = ('coords', 'visibility', 'frames', 'timestamps')
+
+
+def file_sha256(path: str, chunk_size: int = 1 << 20) -> str:
+    """SHA-256 of a file's content, read in chunks"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def landmark_cache_key(video_path: str, exercise: str, options: dict | None) -> str:
+    """Cache key for a video's landmarks under the settings that produced them"""
+    options = options or {}
+    settings = dict(POSE_SETTINGS)
+    settings.update({
+        'mediapipe': getattr(mp, '__version__', ''),
+        'inference_size': options.get('inference_size', INFERENCE_LONG_SIDE),
+        'sample_rate': options.get('sample_rate', SAMPLE_RATE_HZ),
+    })
+    if settings['sample_rate']:
+        # adaptive sampling follows the exercise's thresholds, so interpolated rows differ per exercise
+        settings['exercise'] = exercise
+    digest = hashlib.sha256(file_sha256(video_path).encode())
+    digest.update(json.dumps(settings, sort_keys=True).encode())
+    return digest.hexdigest()
+
+
+def load_cached_landmarks(key: str) -> LandmarkBuffer | None:
+    """Memory-map cached landmarks for ``key``, or None if they are not cached"""
+    path = os.path.join(LANDMARK_CACHE_DIR, key)
+    if not os.path.isdir(path):
+        return None
+    try:
+        arrays = {name: np.load(os.path.join(path, f'{name}.npy'), mmap_mode='r') for name in LANDMARK_ARRAYS}
+    except (OSError, ValueError):
+        return None
+    try:
+        os.utime(path)  # a hit counts as a use for eviction
+    except OSError:
+        pass
+    return LandmarkBuffer.from_arrays(arrays, copy=False)
+
+
+def save_cached_landmarks(key: str, landmarks: LandmarkBuffer):
+    """Write landmarks to the cache; the directory appears atomically once complete"""
+    path = os.path.join(LANDMARK_CACHE_DIR, key)
+    if os.path.isdir(path):
+        return
+    tmp_path = f'{path}.tmp-{uuid.uuid4().hex}'
+    os.makedirs(tmp_path, exist_ok=True)
+    try:
+        for name, values in landmarks.arrays().items():
+            np.save(os.path.join(tmp_path, f'{name}.npy'), values)
+        os.replace(tmp_path, path)
+    except OSError:
+        # another job cached the same video first
+        shutil.rmtree(tmp_path, ignore_errors=True)
+    evict_landmark_cache(keep=key)
+
+
+def evict_landmark_cache(keep: str | None = None):
+    """Delete least recently used cache entries (by mtime) until the cache fits ``LANDMARK_CACHE_MB``"""
+    if LANDMARK_CACHE_MB <= 0:
+        return
+    entries = []
+    try:
+        names = os.listdir(LANDMARK_CACHE_DIR)
+    except OSError:
+        return
+    for name in names:
+        if '.tmp-' in name:
+            continue
+        path = os.path.join(LANDMARK_CACHE_DIR, name)
+        try:
+            size = sum(entry.stat().st_size for entry in os.scandir(path))
+            entries.append((os.stat(path).st_mtime, size, name))
+        except OSError:
+            continue
+    total = sum(size for _, size, _ in entries)
+    budget = LANDMARK_CACHE_MB * 1024 * 1024
+    for _, size, name in sorted(entries):
+        if total <= budget:
+            break
+        if name == keep:
+            continue
+        # sessions already holding these arrays keep their memory maps
+        shutil.rmtree(os.path.join(LANDMARK_CACHE_DIR, name), ignore_errors=True)
+        total -= size
+
+
+def live_metrics(record: dict) -> dict:
+    """Live metrics shown while a session runs, from its latest record"""
+    return {
+        'count': record['count'],
+        'feedback': record['feedback'],
+        'elbow_angle': int(record['elbow_angle']),
+        'hip_angle': int(record['hip_angle']),
+    }
+
+
+# How each viewer's stream is paced against the video clock (the analysis job itself never waits):
+#   realtime   - hold each frame until its CAP_PROP_POS_MSEC time, so the viewer sees the clip at normal speed
+#   throughput - never wait; always send the newest frame
+#   lag-drop   - realtime, but frames that are already too late are dropped instead of shown
+#   auto       - realtime
+PACING_MODES = ('auto', 'realtime', 'throughput', 'lag-drop')
+PACING_MODE = os.environ.get('PACING_MODE', 'auto')
+PACING_LAG_MS = float(os.environ.get('PACING_LAG_MS', 200))
+# Published frames kept per session for paced viewers to walk through; a
+# viewer that falls further behind the job than this skips ahead.
+STREAM_BUFFER_FRAMES = int(os.environ.get('STREAM_BUFFER_FRAMES', 90))
+
+
+def parse_pacing_mode(value, default: str = PACING_MODE) -> str:
+    """Validate a requested pacing mode"""
+    value = (value or '').strip().lower()
+    return value if value in PACING_MODES else default
+
+
+class FramePacer:
+    """Schedules one viewer's frames against the video's own timestamps.
+
+    The clock is anchored at the first paced frame, so time spent before the
+    viewer attached is never made up for.
+    """
+
+    # A realtime stream this far behind re-anchors instead of fast-forwarding
+    MAX_CATCH_UP_S = 1.0
+
+    def __init__(self, mode: str = PACING_MODE, lag_ms: float = PACING_LAG_MS):
+        mode = parse_pacing_mode(mode, 'auto')
+        self.mode = 'realtime' if mode == 'auto' else mode
+        self.lag_s = lag_ms / 1000.0
+        self.origin = None
+        self.last_ms = None
+        self.frame_ms = 1000.0 / 30
+
+    def pace(self, timestamp_ms: float | None) -> bool:
+        """Wait until a frame is due; returns False if it should be dropped"""
+        if timestamp_ms is None:
+            # frames without a pose carry no record: assume the previous frame interval
+            timestamp_ms = (self.last_ms or 0.0) + self.frame_ms
+        elif self.last_ms is not None and timestamp_ms > self.last_ms:
+            self.frame_ms = timestamp_ms - self.last_ms
+        self.last_ms = timestamp_ms
+
+        mode = self.mode
+        if mode == 'throughput':
+            return True
+
+        now = time.monotonic()
+        due = timestamp_ms / 1000.0
+        if self.origin is None:
+            self.origin = now - due
+        delay = self.origin + due - now
+        if delay > 0:
+            time.sleep(delay)
+            return True
+        if mode == 'lag-drop' and -delay > self.lag_s:
+            # skip this frame; the next one is scheduled from here so the stream resumes promptly
+            self.origin = now - due
+            return False
+        if -delay > self.MAX_CATCH_UP_S:
+            self.origin = now - due
+        return True
+
+
+def set_live_metrics(session: dict, metrics: dict):
+    """Replace a session's live metrics and wake up event-stream listeners if they changed"""
+    if metrics == session.get('current_metrics'):
+        return
+    cond = session['frame_cond']
+    with cond:
+        session['current_metrics'] = metrics
+        session['metrics_seq'] = session.get('metrics_seq', 0) + 1
+        cond.notify_all()
+
+
+def analyze_video_generator(session_id: str):
+    session = sessions.get(session_id)
+    if not session:
+        return
+
+    video_path = session['video_path']
+
+    if not MEDIAPIPE_AVAILABLE:
+        # Fallback: simple video processing without pose detection
+        cap = open_video(video_path)
+        yield from analyze_video_simple(session_id, cap)
+        return
+
+    exercise = session.get('exercise', 'pushup')
+    options = session.get('options')
+    records = SessionRecords()
+    summary = session['summary'] = RunningSummary()
+    csv_out = None
+
+    def has_viewers():
+        return session.get('viewers', 0) > 0
+
+    try:
+        cache_key = landmark_cache_key(video_path, exercise, options)
+    except OSError:
+        cache_key = None
+    cached = load_cached_landmarks(cache_key) if cache_key else None
+
+    try:
+        if cached is not None:
+            # Seen this video with these settings before: re-score the stored landmarks
+            # instead of running pose inference again; viewers replay the annotated frames.
+            session['landmarks'] = cached
+            session['landmarks_key'] = cache_key
+            records = analyze_landmark_series(exercise, cached)
+            session['summary'] = RunningSummary.from_records(records)
+            if records:
+                set_live_metrics(session, live_metrics(records[-1]))
+            return
+
+        track = analyze_video_segments(video_path, exercise, options) if (options or {}).get('offline') else None
+        if track is not None:
+            # Long offline job: segments were analysed in parallel, score the stitched series once
+            session['landmarks'] = track
+            records = analyze_landmark_series(exercise, track)
+            session['summary'] = RunningSummary.from_records(records)
+            if records:
+                set_live_metrics(session, live_metrics(records[-1]))
+        else:
+            # skipped frames are interpolated into the track too: one row per video frame, whatever the sampling
+            probe = cv2.VideoCapture(video_path)
+            track = LandmarkBuffer(probe.get(cv2.CAP_PROP_FRAME_COUNT))
+            probe.release()
+            session['landmarks'] = track
+            csv_out = CsvRecordWriter(session_output_path(session_id, 'csv'))
+            session['csv_path'] = csv_out.path
+            for record, frame_bytes in iter_pose_results(video_path, exercise, options, track, has_viewers):
+                if record is not None:
+                    records.append(record)
+                    summary.update(record)
+                    csv_out.write(record)
+
+                    # Update live metrics
+                    set_live_metrics(session, live_metrics(record))
+
+                if frame_bytes is not None:
+                    yield (record['timestamp_ms'] if record else None), frame_bytes
+
+        if cache_key:
+            try:
+                save_cached_landmarks(cache_key, track)
+                session['landmarks_key'] = cache_key
+            except OSError as e:
+                print(f"Could not cache landmarks for {session_id}: {e}")
+    finally:
+        finish_session(session_id, session, records, csv_out)
+
+
+def publish_frame(session: dict, frame_bytes: bytes | None, timestamp_ms: float | None = None):
+    """Buffer an annotated JPEG (and its video time) for a session and wake up stream viewers"""
+    cond = session['frame_cond']
+    with cond:
+        if frame_bytes is not None:
+            session['frame_seq'] += 1
+            session['recent_frames'].append((session['frame_seq'], timestamp_ms, frame_bytes))
+        cond.notify_all()
+
+
+def run_analysis_job(session_id: str):
+    """Run the analysis pipeline for a session to completion, independent of any viewer"""
+    session = sessions.get(session_id)
+    if not session:
+        return
+    try:
+        for timestamp_ms, frame_bytes in analyze_video_generator(session_id):
+            publish_frame(session, frame_bytes, timestamp_ms)
+    except Exception as e:
+        print(f"Analysis job {session_id} failed: {e}")
+    finally:
+        session['is_done'] = True
+        publish_frame(session, None)
+    if RENDER_VIDEO and not session.get('options', {}).get('offline'):
+        render_session_video(session_id)
+
+
+_jobs_lock = threading.Lock()
+
+
+def start_analysis_job(session_id: str):
+    """Start the background analysis for a session once; later calls are no-ops"""
+    session = sessions.get(session_id)
+    if not session:
+        return
+    with _jobs_lock:
+        if session.get('job') is not None:
+            return
+        job = threading.Thread(target=run_analysis_job, args=(session_id,),
+                               name=f'analysis-{session_id[:8]}', daemon=True)
+        session['job'] = job
+    job.start()
+
+
+# Live camera sessions: the browser posts JPEG frames and a per-session worker
+# scores only the newest one. A frame older than the budget is dropped, not queued.
+LIVE_LATENCY_BUDGET_MS = float(os.environ.get('LIVE_LATENCY_BUDGET_MS', 150))
+# A live session with no frames for this long is finished automatically.
+LIVE_IDLE_TIMEOUT_S = float(os.environ.get('LIVE_IDLE_TIMEOUT_S', 30))
+
+
+def submit_live_frame(session: dict, jpeg: bytes, client_ts_ms: float | None) -> dict:
+    """Hand a camera frame to the live worker and wait (up to the latency budget) for its result"""
+    live = session['live']
+    cond = session['frame_cond']
+    budget_s = LIVE_LATENCY_BUDGET_MS / 1000.0
+    with cond:
+        live['seq'] += 1
+        seq = live['seq']
+        if live['pending'] is not None:
+            live['dropped'] += 1  # the worker never got to it: newest frame wins
+        live['pending'] = (seq, time.monotonic(), jpeg, client_ts_ms)
+        cond.notify_all()
+        cond.wait_for(lambda: live['done_seq'] >= seq or live['seq'] > seq or session.get('is_done'),
+                      timeout=budget_s)
+        result = live['result']
+        done_seq = live['done_seq']
+    if result is not None and result['seq'] == seq:
+        return dict(result, status='ok')
+    status = 'dropped' if done_seq >= seq or live['seq'] > seq else 'pending'
+    return {'seq': seq, 'status': status, 'metrics': dict(session['current_metrics'])}
+
+
+def run_live_worker(session_id: str):
+    """Pose worker of a live session: scores the newest posted frame with the exercise rules"""
+    session = sessions.get(session_id)
+    if not session:
+        return
+    live = session['live']
+    cond = session['frame_cond']
+    options = session.get('options') or {}
+    exercise = session.get('exercise', 'pushup')
+    inference_size = options.get('inference_size', INFERENCE_LONG_SIDE)
+    budget_s = LIVE_LATENCY_BUDGET_MS / 1000.0
+    state = new_rep_state(exercise)
+    records = SessionRecords()
+    track = LandmarkBuffer()
+    summary = session['summary'] = RunningSummary()
+    csv_out = CsvRecordWriter(session_output_path(session_id, 'csv'))
+    session['csv_path'] = csv_out.path
+    session['landmarks'] = track
+    pose = mp_pose.Pose(**POSE_SETTINGS)
+    started = time.monotonic()
+    first_client_ts = None
+    frame_index = 0
+    try:
+        while True:
+            with cond:
+                cond.wait_for(lambda: live['pending'] is not None or live['stop'], timeout=LIVE_IDLE_TIMEOUT_S)
+                item = live['pending']
+                live['pending'] = None
+                if item is None:
+                    break  # stopped, or idle for too long
+                if time.monotonic() - item[1] > budget_s:
+                    live['dropped'] += 1  # too old to be worth scoring
+                    live['done_seq'] = item[0]
+                    cond.notify_all()
+                    continue
+            seq, received, jpeg, client_ts = item
+
+            result = {'seq': seq, 'metrics': None, 'landmarks': None}
+            frame = cv2.imdecode(np.frombuffer(jpeg, dtype=np.uint8), cv2.IMREAD_COLOR)
+            if frame is not None:
+                frame_index += 1
+                if client_ts is not None:
+                    first_client_ts = client_ts if first_client_ts is None else first_client_ts
+                    timestamp_ms = client_ts - first_client_ts
+                else:
+                    timestamp_ms = (received - started) * 1000.0
+                image = cv2.cvtColor(resize_for_inference(frame, inference_size), cv2.COLOR_BGR2RGB)
+                results = pose.process(image)
+                if results.pose_landmarks:
+                    landmarks = landmarks_to_array(results.pose_landmarks)
+                    track.extend([frame_index], [timestamp_ms], landmarks[None])
+                    record = make_rep_record(state, frame_index, timestamp_ms,
+                                             feature_row(pose_features(landmarks[None]), 0))
+                    records.append(record)
+                    summary.update(record)
+                    csv_out.write(record)
+                    set_live_metrics(session, live_metrics(record))
+                    result['landmarks'] = np.round(landmarks, 4).tolist()
+            result['metrics'] = dict(session['current_metrics'])
+            result['latency_ms'] = round((time.monotonic() - received) * 1000.0, 1)
+
+            with cond:
+                live['result'] = result
+                live['done_seq'] = seq
+                cond.notify_all()
+    except Exception as e:
+        print(f"Live session {session_id} failed: {e}")
+    finally:
+        pose.close()
+        finish_session(session_id, session, records, csv_out)
+        publish_frame(session, None)
+
+
+# JPEG quality frames are produced at, and the floor a struggling viewer's
+# stream may be degraded to. Viewers can ask for ?quality= and ?width= per stream.
+JPEG_QUALITY = int(os.environ.get('JPEG_QUALITY', 80))
+STREAM_MIN_QUALITY = int(os.environ.get('STREAM_MIN_QUALITY', 30))
+
 
-    total_elbow = 0.0
-    total_hip = 0.0
-    min_e = float('inf')
-    max_e = float('-inf')
-    min_h = float('inf')
-    max_h = float('-inf')
-
-    for r in records:
-        e = float(r.get('elbow_angle', 0.0))
-        h = float(r.get('hip_angle', 0.0))
-        total_elbow += e
-        total_hip += h
-        min_e = min(min_e, e)
-        max_e = max(max_e, e)
-        min_h = min(min_h, h)
-        max_h = max(max_h, h)
-        fb = r.get('feedback', '')
-        if fb == 'Keep your hips straight!':
-            summary['hip_warning_frames'] += 1
-        elif fb == 'Go lower!':
-            summary['go_lower_frames'] += 1
-        elif fb == 'Good form!':
-            summary['good_form_frames'] += 1
-        summary['last_feedback'] = fb
-
-    summary['total_frames'] = len(records)
-    summary['total_reps'] = int(records[-1].get('count', 0))
-    first_ts = float(records[0].get('timestamp_ms', 0.0))
-    last_ts = float(records[-1].get('timestamp_ms', 0.0))
-    if last_ts >= first_ts:
-        summary['duration_ms'] = last_ts - first_ts
-    summary['avg_elbow_angle'] = total_elbow / len(records)
-    summary['avg_hip_angle'] = total_hip / len(records)
-    summary['min_elbow_angle'] = min_e if min_e != float('inf') else 0.0
-    summary['max_elbow_angle'] = max_e if max_e != float('-inf') else 0.0
-    summary['min_hip_angle'] = min_h if min_h != float('inf') else 0.0
-    summary['max_hip_angle'] = max_h if max_h != float('-inf') else 0.0
-    return summary
+def parse_stream_settings(args) -> tuple[int | None, int | None]:
+    """Per-stream ``(quality, width)`` from query args; None keeps the produced frame"""
+    try:
+        quality = max(STREAM_MIN_QUALITY, min(95, int(args.get('quality'))))
+    except (TypeError, ValueError):
+        quality = None
+    try:
+        width = int(args.get('width'))
+        width = max(160, min(1920, width)) if width > 0 else None
+    except (TypeError, ValueError):
+        width = None
+    return quality, width
 
 
-def analyze_video_simple(session_id: str, cap):
-    """Simple video analysis without MediaPipe (fallback)"""
-    session = sessions.get(session_id)
-    if not session:
-        return
+def reencode_jpeg(frame_bytes: bytes, quality: int, width: int | None = None) -> bytes | None:
+    """Decode a published frame and encode it again at a viewer's quality and width"""
+    image = cv2.imdecode(np.frombuffer(frame_bytes, dtype=np.uint8), cv2.IMREAD_COLOR)
+    if image is None:
+        return None
+    if width and image.shape[1] > width:
+        height = max(1, round(image.shape[0] * width / image.shape[1]))
+        image = cv2.resize(image, (width, height), interpolation=cv2.INTER_AREA)
+    ret, buffer = cv2.imencode('.jpg', image, [cv2.IMWRITE_JPEG_QUALITY, quality])
+    return buffer.tobytes() if ret else None
 
-    count = 0
-    records = []
-    frame_count = 0
-    exercise = session.get('exercise', 'pushup')
-    
-    # Basic timing for different exercises
-    count_interval = {
-        'pushup': 45,
-        'pullup': 60, 
-        'situp': 40,
-        'jumping_jack': 30,
-        'plank': 30  # For plank, count seconds
-    }.get(exercise, 45)
 
-    try:
-        while cap.isOpened():
-            ret, frame = cap.read()
-            if not ret:
-                break
+class AdaptiveJpegQuality:
+    """Per-viewer JPEG quality that backs off while the client cannot keep up.
 
-            frame_count += 1
-            current_timestamp_ms = cap.get(cv2.CAP_PROP_POS_MSEC)
-            
-            # Exercise-specific counting
-            if exercise == 'plank':
-                # Count seconds for plank
-                count = frame_count // 30  # Assuming 30 FPS
-                feedback = "Hold steady position"
-            else:
-                # Count reps for other exercises
-                if frame_count % count_interval == 0:
-                    count += 1
-                feedback = f"Basic {exercise.replace('_', ' ')} analysis"
+    A viewer counts as behind when it missed frames and spent longer writing
+    the last one than waiting for the next, i.e. the connection and not the
+    analysis is the bottleneck. Quality then steps down towards
+    ``STREAM_MIN_QUALITY`` and recovers slowly once the client keeps up again.
+    """
 
-            record = {
-                "frame": frame_count,
-                "timestamp_ms": float(current_timestamp_ms) if current_timestamp_ms is not None else 0.0,
-                "elbow_angle": 90.0,
-                "hip_angle": 180.0,
-                "stage": "up",
-                "count": count,
-                "feedback": feedback,
-            }
-            records.append(record)
+    STEP_DOWN = 10
+    STEP_UP = 5
+    RECOVER_AFTER = 30  # frames in a row without falling behind
 
-            # Update live metrics
-            session['current_metrics'] = {
-                'count': count,
-                'feedback': feedback,
-                'elbow_angle': 90,
-                'hip_angle': 180,
-            }
+    def __init__(self, quality: int | None = None, width: int | None = None):
+        self.target = quality or JPEG_QUALITY
+        self.quality = self.target
+        self.width = width
+        self.steady = 0
 
-            # Draw overlay
-            label = "Secs" if exercise == 'plank' else "Reps"
-            cv2.putText(frame, f"{label}: {count}", (20, 40),
-                        cv2.FONT_HERSHEY_SIMPLEX, 1, (0, 255, 0), 2, cv2.LINE_AA)
-            cv2.putText(frame, "Basic Analysis Mode", (20, 80),
-                        cv2.FONT_HERSHEY_SIMPLEX, 0.9, (255, 165, 0), 2, cv2.LINE_AA)
-            cv2.putText(frame, exercise.replace('_', ' ').title(), (20, 120),
-                        cv2.FONT_HERSHEY_SIMPLEX, 0.8, (0, 255, 255), 2, cv2.LINE_AA)
+    def update(self, skipped: int, write_s: float, wait_s: float):
+        if skipped and write_s > wait_s:
+            self.quality = max(STREAM_MIN_QUALITY, self.quality - self.STEP_DOWN)
+            self.steady = 0
+        elif self.quality < self.target:
+            self.steady += 1
+            if self.steady >= self.RECOVER_AFTER:
+                self.quality = min(self.target, self.quality + self.STEP_UP)
+                self.steady = 0
 
-            ret2, buffer = cv2.imencode('.jpg', frame)
-            if not ret2:
-                continue
-            frame_bytes = buffer.tobytes()
-            yield (b'--frame\r\n'
-                   b'Content-Type: image/jpeg\r\n\r\n' + frame_bytes + b'\r\n')
+    def encode(self, frame_bytes: bytes) -> bytes | None:
+        if self.quality == JPEG_QUALITY and not self.width:
+            return frame_bytes
+        return reencode_jpeg(frame_bytes, self.quality, self.width)
 
-            time.sleep(0.01)
-    finally:
-        cap.release()
-        # Save CSV
-        session['records'] = records
-        try:
-            if records:
-                csv_dir = os.path.join('static', 'sessions')
-                os.makedirs(csv_dir, exist_ok=True)
-                csv_path = os.path.join(csv_dir, f'{session_id}.csv')
-                fieldnames = [
-                    "frame", "timestamp_ms", "elbow_angle", "hip_angle", "stage", "count", "feedback"
-                ]
-                with open(csv_path, 'w', newline='') as csvfile:
-                    writer = csv.DictWriter(csvfile, fieldnames=fieldnames)
-                    writer.writeheader()
-                    writer.writerows(records)
-                session['csv_path'] = csv_path
-                # Append to history
-                try:
-                    session_history.append({
-                        'session_id': session_id,
-                        'exercise': session.get('exercise', 'pushup'),
-                        'total_reps': int(records[-1].get('count', 0)),
-                        'duration_s': round((records[-1].get('timestamp_ms', 0.0) - records[0].get('timestamp_ms', 0.0))/1000.0, 2) if len(records) > 1 else 0,
-                        'created_at': time.time(),
-                        'user_id': session.get('user_id'),
-                    })
-                    
-                    # Add to user's session history
-                    if session.get('user_id'):
-                        users = load_users()
-                        user_email = None
-                        for email, user_data in users.items():
-                            if user_data.get('id') == session.get('user_id'):
-                                user_email = email
-                                break
-                        
-                        if user_email:
-                            session_summary = {
-                                'session_id': session_id,
-                                'exercise': session.get('exercise', 'pushup'),
-                                'total_reps': int(records[-1].get('count', 0)),
-                                'duration_s': round((records[-1].get('timestamp_ms', 0.0) - records[0].get('timestamp_ms', 0.0))/1000.0, 2) if len(records) > 1 else 0,
-                                'created_at': datetime.now().isoformat(),
-                            }
-                            users[user_email]['sessions'].append(session_summary)
-                            save_users(users)
-                except Exception:
-                    pass
-        except Exception:
-            session['csv_path'] = None
-        session['is_done'] = True
 
+def stream_session_frames(session_id: str, quality: int | None = None, width: int | None = None):
+    """Yield the annotated frames to one viewer until the analysis finishes.
 
-def analyze_video_generator(session_id: str):
+    Viewers only read what the job publishes, so a slow or disconnected client
+    never slows down or cuts short the analysis itself: each viewer keeps its
+    own cursor into the session's frame buffer and its own ``FramePacer``, and
+    skips frames it fell too far behind on, with its JPEG quality adapting
+    down meanwhile. The job only
+    renders frames while at least one viewer is attached; a viewer that
+    arrives after a headless run gets a replay drawn from the stored
+    landmarks (or, in basic mode, the stored counts) instead.
+    """
     session = sessions.get(session_id)
     if not session:
         return
+    cond = session['frame_cond']
+    with cond:
+        session['viewers'] = session.get('viewers', 0) + 1
+    encoder = AdaptiveJpegQuality(quality, width)
+    pacer = FramePacer(session.get('options', {}).get('pacing', PACING_MODE))
+    last_seq = 0
+    streamed = False
+    write_s = 0.0
+    try:
+        while True:
+            waited = time.monotonic()
+            with cond:
+                cond.wait_for(lambda: session['frame_seq'] != last_seq or session.get('is_done'), timeout=1.0)
+                frames = session['recent_frames']
+                entry = None
+                if frames and frames[-1][0] > last_seq:
+                    # throughput (and a viewer's first frame) jumps to the newest; paced viewers walk the buffer in order
+                    newest = pacer.mode == 'throughput' or not streamed
+                    entry = frames[-1] if newest else frames[max(0, last_seq + 1 - frames[0][0])]
+                done = session.get('is_done', False)
+            if done and not streamed and replayable(session):
+                break
+            if entry is not None:
+                seq, timestamp_ms, frame_bytes = entry
+                encoder.update(seq - last_seq - 1 if streamed else 0, write_s, time.monotonic() - waited)
+                last_seq = seq
+                streamed = True
+                if not pacer.pace(timestamp_ms):
+                    continue
+                frame_bytes = encoder.encode(frame_bytes)
+                if frame_bytes is None:
+                    continue
+                writing = time.monotonic()
+                yield (b'--frame\r\n'
+                       b'Content-Type: image/jpeg\r\n\r\n' + frame_bytes + b'\r\n')
+                write_s = time.monotonic() - writing
+            elif done:
+                break
 
-    video_path = session['video_path']
-    cap = cv2.VideoCapture(video_path)
-    
-    if not MEDIAPIPE_AVAILABLE:
-        # Fallback: simple video processing without pose detection
-        yield from analyze_video_simple(session_id, cap)
-        return
-    
-    pose = mp_pose.Pose(min_detection_confidence=0.5, min_tracking_confidence=0.5)
+        if not streamed and replayable(session):
+            for timestamp_ms, frame_bytes in render_replay_frames(session):
+                if pacer.pace(timestamp_ms):
+                    frame_bytes = encoder.encode(frame_bytes)
+                    if frame_bytes is not None:
+                        yield (b'--frame\r\n'
+                               b'Content-Type: image/jpeg\r\n\r\n' + frame_bytes + b'\r\n')
+    finally:
+        with cond:
+            session['viewers'] -= 1
 
-    count = 0
-    stage = "up"
-    feedback = ""
-    records = []
-    exercise = session.get('exercise', 'pushup')
-    start_ms = None
 
-    try:
-        while cap.isOpened():
-            ret, frame = cap.read()
-            if not ret:
-                break
+def analysis_options(form) -> dict:
+    """Per-session analysis options from a submitted form"""
+    return {
+        'inference_size': parse_inference_size(form.get('inference_size')),
+        'sample_rate': parse_sample_rate(form.get('sample_rate')),
+        'pacing': parse_pacing_mode(form.get('pacing')),
+    }
 
-            image = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-            image.flags.writeable = False
-            results = pose.process(image)
-            image.flags.writeable = True
-            image = cv2.cvtColor(image, cv2.COLOR_RGB2BGR)
 
-            try:
-                if results.pose_landmarks:
-                    landmarks = results.pose_landmarks.landmark
-
-                    shoulder = [landmarks[11].x, landmarks[11].y]
-                    elbow = [landmarks[13].x, landmarks[13].y]
-                    wrist = [landmarks[15].x, landmarks[15].y]
-                    hip = [landmarks[23].x, landmarks[23].y]
-                    ankle = [landmarks[27].x, landmarks[27].y]
-                    shoulder_r = [landmarks[12].x, landmarks[12].y]
-                    wrist_r = [landmarks[16].x, landmarks[16].y]
-                    ankle_r = [landmarks[28].x, landmarks[28].y]
-                    # nose = [landmarks[0].x, landmarks[0].y]  # Removed: not used
-
-                    elbow_angle = calculate_angle(shoulder, elbow, wrist)
-                    hip_angle = calculate_angle(shoulder, hip, ankle)
-
-                    current_frame_index = int(cap.get(cv2.CAP_PROP_POS_FRAMES))
-                    current_timestamp_ms = cap.get(cv2.CAP_PROP_POS_MSEC)
-                    if start_ms is None and current_timestamp_ms is not None:
-                        start_ms = current_timestamp_ms
-
-                    if exercise == 'pushup':
-                        if elbow_angle <= 90 and hip_angle > 160:
-                            stage = "down"
-                        if elbow_angle >= 160 and hip_angle > 160 and stage == "down":
-                            count += 1
-                            stage = "up"
-
-                        if hip_angle < 160:
-                            feedback = "Keep your hips straight!"
-                        elif elbow_angle > 100 and stage == "down":
-                            feedback = "Go lower!"
-                        else:
-                            feedback = "Good form!"
-
-                    elif exercise == 'pullup':
-                        # Simple elbow flexion based heuristic for pull-ups
-                        # Down (bottom) ~ elbow extended; Up (top) ~ elbow flexed
-                        if elbow_angle >= 150:
-                            stage = "down"
-                        if elbow_angle <= 70 and stage == "down":
-                            count += 1
-                            stage = "up"
-                        # Form: encourage full range and avoid swinging (approx via hip angle stability)
-                        if elbow_angle > 160:
-                            feedback = "Fully hang before pulling."
-                        elif elbow_angle < 60:
-                            feedback = "Strong pull! Control the descent."
-                        else:
-                            feedback = "Keep pulling vertically."
-
-                    elif exercise == 'situp':
-                        # Use hip angle closing to detect the up position
-                        if hip_angle >= 150:
-                            stage = "down"
-                        if hip_angle <= 100 and stage == "down":
-                            count += 1
-                            stage = "up"
-                        if hip_angle > 170:
-                            feedback = "Start from flat back."
-                        elif hip_angle < 90:
-                            feedback = "Good sit-up height."
-                        else:
-                            feedback = "Curl up smoothly; avoid neck strain."
-
-                    elif exercise == 'jumping_jack':
-                        # Consider "open" when feet apart and hands high; "closed" when feet together and hands low
-                        feet_apart_x = abs(ankle[0] - ankle_r[0])
-                        hands_high = (wrist[1] < shoulder[1] - 0.1) and (wrist_r[1] < shoulder_r[1] - 0.1)
-                        open_pos = feet_apart_x > 0.35 and hands_high
-                        if open_pos:
-                            stage = "open"
-                        if not open_pos and stage == "open":
-                            count += 1
-                            stage = "closed"
-                        feedback = "Arms overhead, feet wide" if open_pos else "Return to start position"
-
-                    elif exercise == 'plank':
-                        # Count seconds of good plank (hip straight). Use time diff.
-                        good_form = hip_angle > 165
-                        if good_form and current_timestamp_ms is not None and start_ms is not None:
-                            count = int(max(0, (current_timestamp_ms - start_ms) / 1000.0))
-                        feedback = "Hips level" if good_form else "Lift hips to neutral"
-                    else:
-                        # Default to pushup logic
-                        if elbow_angle <= 90 and hip_angle > 160:
-                            stage = "down"
-                        if elbow_angle >= 160 and hip_angle > 160 and stage == "down":
-                            count += 1
-                            stage = "up"
-                        feedback = "Good form!"
-                    record = {
-                        "frame": current_frame_index,
-                        "timestamp_ms": float(current_timestamp_ms) if current_timestamp_ms is not None else 0.0,
-                        "elbow_angle": float(elbow_angle),
-                        "hip_angle": float(hip_angle),
-                        "stage": stage,
-                        "count": int(count),
-                        "feedback": feedback,
-                    }
-                    records.append(record)
+def record_session_history(session_id: str, session: dict, records):
+    """Add a finished session to its user's sessions (and so to the history page)"""
+    summary = {
+        'session_id': session_id,
+        'exercise': session.get('exercise', 'pushup'),
+        'total_reps': int(records[-1].get('count', 0)),
+        'duration_s': round((records[-1].get('timestamp_ms', 0.0) - records[0].get('timestamp_ms', 0.0))/1000.0, 2) if len(records) > 1 else 0,
+    }
+    if session.get('user_id'):
+        add_user_session(session['user_id'], dict(summary, created_at=datetime.now().isoformat()))
 
-                    # Update live metrics
-                    session['current_metrics'] = {
-                        'count': int(count),
-                        'feedback': feedback,
-                        'elbow_angle': int(elbow_angle),
-                        'hip_angle': int(hip_angle),
-                    }
 
-                    # Draw overlays
-                    label = "Secs" if exercise == 'plank' else "Reps"
-                    cv2.putText(image, f"{label}: {count}", (20, 40),
-                                cv2.FONT_HERSHEY_SIMPLEX, 1, (0, 255, 0), 2, cv2.LINE_AA)
-                    cv2.putText(image, f"Feedback: {feedback}", (20, 80),
-                                cv2.FONT_HERSHEY_SIMPLEX, 0.9, (0, 0, 255), 2, cv2.LINE_AA)
-                    cv2.putText(image, f"Elbow: {int(elbow_angle)}", (20, 120),
-                                cv2.FONT_HERSHEY_SIMPLEX, 0.7, (255, 255, 0), 2, cv2.LINE_AA)
-                    cv2.putText(image, f"Hip: {int(hip_angle)}", (20, 150),
-                                cv2.FONT_HERSHEY_SIMPLEX, 0.7, (255, 255, 0), 2, cv2.LINE_AA)
-
-                    mp_drawing.draw_landmarks(image, results.pose_landmarks, mp_pose.POSE_CONNECTIONS)
-            except Exception:
-                pass
-
-            ret2, buffer = cv2.imencode('.jpg', image)
-            if not ret2:
-                continue
-            frame_bytes = buffer.tobytes()
-            yield (b'--frame\r\n'
-                   b'Content-Type: image/jpeg\r\n\r\n' + frame_bytes + b'\r\n')
+def finish_session(session_id: str, session: dict, records, csv_out):
+    """Store a finished session's records, write its exports and add it to the history"""
+    session['records'] = records
+    try:
+        save_session_outputs(session_id, session, records, csv_out)
+        if records:
+            try:
+                record_session_history(session_id, session, records)
+            except Exception as e:
+                print(f"Could not record session {session_id} in history: {e}")
+    except Exception:
+        session['csv_path'] = None
+    session['is_done'] = True
+    sessions.finished(session_id, session)
 
-            time.sleep(0.01)
-    finally:
-        cap.release()
-        if 'pose' in locals() and pose is not None:
-            pose.close()
-        # Save CSV
-        session['records'] = records
-        try:
-            if records:
-                csv_dir = os.path.join('static', 'sessions')
-                os.makedirs(csv_dir, exist_ok=True)
-                csv_path = os.path.join(csv_dir, f'{session_id}.csv')
-                fieldnames = [
-                    "frame", "timestamp_ms", "elbow_angle", "hip_angle", "stage", "count", "feedback"
-                ]
-                with open(csv_path, 'w', newline='') as csvfile:
-                    writer = csv.DictWriter(csvfile, fieldnames=fieldnames)
-                    writer.writeheader()
-                    writer.writerows(records)
-                session['csv_path'] = csv_path
-                # Append to history
-                try:
-                    session_history.append({
-                        'session_id': session_id,
-                        'exercise': session.get('exercise', 'pushup'),
-                        'total_reps': int(records[-1].get('count', 0)),
-                        'duration_s': round((records[-1].get('timestamp_ms', 0.0) - records[0].get('timestamp_ms', 0.0))/1000.0, 2) if len(records) > 1 else 0,
-                        'created_at': time.time(),
-                        'user_id': session.get('user_id'),
-                    })
-                    
-                    # Add to user's session history
-                    if session.get('user_id'):
-                        users = load_users()
-                        user_email = None
-                        for email, user_data in users.items():
-                            if user_data.get('id') == session.get('user_id'):
-                                user_email = email
-                                break
-                        
-                        if user_email:
-                            session_summary = {
-                                'session_id': session_id,
-                                'exercise': session.get('exercise', 'pushup'),
-                                'total_reps': int(records[-1].get('count', 0)),
-                                'duration_s': round((records[-1].get('timestamp_ms', 0.0) - records[0].get('timestamp_ms', 0.0))/1000.0, 2) if len(records) > 1 else 0,
-                                'created_at': datetime.now().isoformat(),
-                            }
-                            users[user_email]['sessions'].append(session_summary)
-                            save_users(users)
-                except Exception:
-                    pass
-        except Exception:
-            session['csv_path'] = None
-        session['is_done'] = True
+
+def create_analysis_session(video_path: str, exercise: str, user_id, options: dict) -> dict:
+    """Initial state for an analysis session; the job and stream viewers fill it in"""
+    return {
+        'video_path': video_path,
+        'records': SessionRecords(),
+        'summary': RunningSummary(),
+        'current_metrics': {'count': 0, 'feedback': '', 'elbow_angle': 0, 'hip_angle': 0},
+        'is_done': False,
+        'csv_path': None,
+        'exercise': exercise,
+        'options': options,
+        'user_id': user_id,
+        'created_at': datetime.now().isoformat(),
+        'job': None,
+        'frame_cond': threading.Condition(),
+        'recent_frames': deque(maxlen=max(1, STREAM_BUFFER_FRAMES)),
+        'frame_seq': 0,
+        'metrics_seq': 0,
+        'viewers': 0,
+    }
 
 
 @app.route('/', methods=['GET'])
@@ -549,25 +3394,20 @@ def signup():
         if len(password) < 6:
             return jsonify({'success': False, 'message': 'Password must be at least 6 characters'})
         
-        users = load_users()
-        
-        if email in users:
-            return jsonify({'success': False, 'message': 'Email already registered'})
-        
         # Create new user
         user_id = str(uuid.uuid4())
-        users[email] = {
+        created = create_user({
             'id': user_id,
             'name': name,
             'email': email,
             'password': hash_password(password),
             'user_type': user_type,
             'created_at': datetime.now().isoformat(),
-            'sessions': [],
             'profile_picture': None
-        }
+        })
         
-        save_users(users)
+        if not created:
+            return jsonify({'success': False, 'message': 'Email already registered'})
         
         # Set session
         session['user_id'] = user_id
@@ -591,13 +3431,11 @@ def signin():
         if not email or not password:
             return jsonify({'success': False, 'message': 'Email and password are required'})
         
-        users = load_users()
+        user = get_user_by_email(email)
         
-        if email not in users:
+        if user is None:
             return jsonify({'success': False, 'message': 'Invalid email or password'})
         
-        user = users[email]
-        
         if not verify_password(password, user['password']):
             return jsonify({'success': False, 'message': 'Invalid email or password'})
         
@@ -631,20 +3469,17 @@ def dashboard(user_type):
     if session.get('user_type') != user_type:
         return redirect(url_for('dashboard', user_type=session.get('user_type', 'athlete')))
     
-    users = load_users()
-    user_email = session.get('user_email')
+    user = get_user(session['user_id'])
     
-    if user_email not in users:
+    if user is None:
         session.clear()
         return redirect(url_for('index'))
     
-    user = users[user_email]
-    user_sessions = user.get('sessions', [])
-    
     return render_template('dashboard.html', 
                          user=user, 
                          user_type=user_type,
-                         sessions=user_sessions[-10:])  # Show last 10 sessions
+                         stats=get_user_stats(user['id']),
+                         sessions=get_user_sessions(user['id'], limit=10))  # Show last 10 sessions
 
 
 @app.route('/profile')
@@ -653,28 +3488,34 @@ def profile():
     if 'user_id' not in session:
         return redirect(url_for('index'))
     
-    users = load_users()
-    user_email = session.get('user_email')
+    user = get_user(session['user_id'])
     
-    if user_email not in users:
+    if user is None:
         session.clear()
         return redirect(url_for('index'))
     
-    user = users[user_email]
-    user_sessions = user.get('sessions', [])
-    
-    # Calculate stats
-    total_reps = sum(session.get('total_reps', 0) for session in user_sessions)
-    total_duration = round(sum(session.get('duration_s', 0) for session in user_sessions) / 60, 1)
-    best_session = max([session.get('total_reps', 0) for session in user_sessions], default=0)
+    stats = get_user_stats(user['id'])
     
     return render_template('profile.html', 
                          user=user, 
                          user_type=session.get('user_type', 'athlete'),
-                         sessions=user_sessions,
-                         total_reps=total_reps,
-                         total_duration=total_duration,
-                         best_session=best_session)
+                         sessions=list(reversed(get_user_sessions(user['id'], limit=5))),
+                         stats=stats,
+                         total_reps=stats['total_reps'],
+                         total_duration=round(stats['total_duration_s'] / 60, 1),
+                         best_session=stats['best_reps'])
+
+
+@app.route('/api/stats', methods=['GET'])
+def api_stats():
+    """The signed-in user's rollups (totals, bests, streaks, per exercise, weekly volume) as JSON"""
+    if 'user_id' not in session:
+        return jsonify({'error': 'Not authenticated'}), 401
+    try:
+        weeks = min(max(int(request.args.get('weeks', 8)), 1), 104)
+    except ValueError:
+        weeks = 8
+    return jsonify(get_user_stats(session['user_id'], weeks))
 
 
 @app.route('/profile/picture', methods=['POST'])
@@ -709,12 +3550,8 @@ def upload_profile_picture():
         file.save(file_path)
         
         # Update user data
-        users = load_users()
-        user_email = session.get('user_email')
-        
-        if user_email in users:
-            users[user_email]['profile_picture'] = f'/static/profiles/{filename}'
-            save_users(users)
+        if get_user(user_id) is not None:
+            update_user(user_id, profile_picture=f'/static/profiles/{filename}')
             
             # Update session
             session['profile_picture'] = f'/static/profiles/{filename}'
@@ -741,30 +3578,15 @@ def edit_profile():
         if not all([name, email]):
             return jsonify({'success': False, 'message': 'Name and email are required'})
         
-        users = load_users()
-        user_email = session.get('user_email')
-        
-        if user_email not in users:
+        if get_user(session['user_id']) is None:
             return jsonify({'success': False, 'message': 'User not found'})
         
-        # Check if email is being changed and if it's already taken
-        if email != user_email and email in users:
+        # The unique email index rejects an address that is already taken
+        if not update_user(session['user_id'], name=name, email=email):
             return jsonify({'success': False, 'message': 'Email already in use'})
         
-        # Update user data
-        user = users[user_email]
-        user['name'] = name
-        
-        # If email is changing, update the key
-        if email != user_email:
-            users[email] = user
-            del users[user_email]
-            session['user_email'] = email
-        
-        user['email'] = email
-        save_users(users)
-        
         # Update session
+        session['user_email'] = email
         session['user_name'] = name
         
         return jsonify({'success': True, 'message': 'Profile updated successfully'})
@@ -791,26 +3613,344 @@ def analyze():
     file.save(save_path)
 
     exercise = (request.form.get('exercise') or 'pushup').strip().lower()
-    if exercise not in { 'pushup', 'pullup', 'situp', 'jumping_jack', 'plank' }:
+    if exercise not in EXERCISES:
         exercise = 'pushup'
 
-    def create_session(video_path, exercise, user_id):
-        return {
-            'video_path': video_path,
-            'records': [],
-            'current_metrics': {'count': 0, 'feedback': '', 'elbow_angle': 0, 'hip_angle': 0},
-            'is_done': False,
-            'csv_path': None,
-            'exercise': exercise,
-            'user_id': user_id,
-            'created_at': datetime.now().isoformat()
-        }
-
-    sessions[session_id] = create_session(save_path, exercise, session['user_id'])
+    options = analysis_options(request.form)
+    sessions[session_id] = create_analysis_session(save_path, exercise, session['user_id'], options)
+    start_analysis_job(session_id)
 
     return redirect(url_for('view_analysis', session_id=session_id))
 
 
+@app.route('/api/analyze', methods=['POST'])
+def api_analyze():
+    """Headless analysis: no frames are rendered unless someone opens the stream"""
+    if 'user_id' not in session:
+        return jsonify({'error': 'Not authenticated'}), 401
+
+    file = request.files.get('video')
+    if file is None or file.filename == '':
+        return jsonify({'error': 'No video uploaded'}), 400
+
+    exercise = (request.form.get('exercise') or 'pushup').strip().lower()
+    if exercise not in EXERCISES:
+        return jsonify({'error': f'Unknown exercise: {exercise}'}), 400
+    options = analysis_options(request.form)
+    options['offline'] = True
+
+    session_id = str(uuid.uuid4())
+    filename = f"{session_id}_{file.filename}"
+    save_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
+    file.save(save_path)
+
+    sessions[session_id] = create_analysis_session(save_path, exercise, session['user_id'], options)
+    start_analysis_job(session_id)
+
+    return jsonify({
+        'session_id': session_id,
+        'exercise': exercise,
+        'metrics_url': url_for('metrics', session_id=session_id),
+        'events_url': url_for('events', session_id=session_id),
+        'video_url': url_for('replay_video', session_id=session_id),
+        'download_url': url_for('download_csv', session_id=session_id),
+        'export_url': url_for('export_npz', session_id=session_id),
+        'stream_url': url_for('stream', session_id=session_id),
+    }), 202
+
+
+# Chunked uploads are kept in the ``uploads`` table of USERS_DB and in
+# ``<path>.part`` files, so any worker can take the next chunk. Suggested chunk
+# size, largest accepted upload, and how long an untouched upload is kept.
+UPLOAD_CHUNK_BYTES = int(os.environ.get('UPLOAD_CHUNK_BYTES', 8 * 1024 * 1024))
+UPLOAD_MAX_MB = float(os.environ.get('UPLOAD_MAX_MB', 2048))
+UPLOAD_EXPIRE_S = float(os.environ.get('UPLOAD_EXPIRE_S', 24 * 3600))
+
+_upload_lock = threading.Lock()  # without fcntl (single-process development server)
+_last_upload_sweep = 0.0
+
+
+def get_upload(upload_id: str) -> dict | None:
+    """The current user's upload, with how many bytes of it are on disk"""
+    row = get_db().execute('SELECT * FROM uploads WHERE id = ?', (upload_id,)).fetchone()
+    if row is None or row['user_id'] != session.get('user_id'):
+        return None
+    upload = dict(row, options=json.loads(row['options']))
+    upload['received'] = upload_received(upload)
+    return upload
+
+
+def upload_received(upload: dict) -> int:
+    if os.path.exists(upload['path']):
+        return upload['size']
+    try:
+        return os.path.getsize(upload['path'] + '.part')
+    except OSError:
+        return 0
+
+
+def lock_upload(upload: dict):
+    """Take an upload's write lock without waiting; returns the handle for ``unlock_upload``, or None if it is held"""
+    if fcntl is None:
+        return _upload_lock if _upload_lock.acquire(blocking=False) else None
+    handle = open(upload['path'] + '.lock', 'a')
+    try:
+        fcntl.flock(handle, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        handle.close()
+        return None
+    return handle
+
+
+def unlock_upload(handle):
+    if handle is _upload_lock:
+        handle.release()
+    else:
+        handle.close()
+
+
+def sweep_uploads():
+    """Forget uploads untouched for UPLOAD_EXPIRE_S and delete their unfinished files"""
+    global _last_upload_sweep
+    now = time.time()
+    if now - _last_upload_sweep < min(600.0, UPLOAD_EXPIRE_S):
+        return
+    _last_upload_sweep = now
+    cutoff = now - UPLOAD_EXPIRE_S
+    get_db().execute('DELETE FROM uploads WHERE updated_at < ?', (cutoff,))
+    folder = app.config['UPLOAD_FOLDER']
+    for name in os.listdir(folder):
+        path = os.path.join(folder, name)
+        try:
+            if name.endswith('.part') and os.path.getmtime(path) < cutoff:
+                os.remove(path)
+            elif name.endswith('.lock') and not os.path.exists(path[:-len('.lock')] + '.part'):
+                os.remove(path)  # its upload finished or was swept
+        except OSError:
+            pass
+
+
+def upload_status(upload_id: str, upload: dict) -> dict:
+    status = {
+        'upload_id': upload_id,
+        'size': upload['size'],
+        'received': upload['received'],
+        'complete': upload['received'] >= upload['size'],
+        'session_id': upload['session_id'],
+    }
+    if upload['session_id']:
+        status['view_url'] = url_for('view_analysis', session_id=upload['session_id'])
+        status['events_url'] = url_for('events', session_id=upload['session_id'])
+    return status
+
+
+def start_upload_analysis(upload: dict):
+    """Create the analysis session for an upload and start its job (once, in whichever worker gets there first)"""
+    if upload['session_id']:
+        return
+    session_id = str(uuid.uuid4())
+    claimed = get_db().execute('UPDATE uploads SET session_id = ? WHERE id = ? AND session_id IS NULL',
+                               (session_id, upload['id'])).rowcount
+    if not claimed:
+        upload['session_id'] = get_db().execute('SELECT session_id FROM uploads WHERE id = ?',
+                                                (upload['id'],)).fetchone()['session_id']
+        return
+    upload['session_id'] = session_id
+    sessions[session_id] = create_analysis_session(upload['path'], upload['exercise'], upload['user_id'], upload['options'])
+    start_analysis_job(session_id)
+
+
+@app.route('/upload', methods=['POST'])
+def upload_start():
+    """Start a chunked upload: JSON ``{filename, size, exercise, ...}``; chunks are then PUT to the upload URL"""
+    if 'user_id' not in session:
+        return jsonify({'error': 'Not authenticated'}), 401
+    data = request.get_json(silent=True) or {}
+    if not isinstance(data, dict):
+        return jsonify({'error': 'Expected a JSON object'}), 400
+    filename = os.path.basename(str(data.get('filename') or ''))
+    try:
+        size = int(data.get('size'))
+    except (TypeError, ValueError):
+        size = 0
+    if not filename or size <= 0:
+        return jsonify({'error': 'filename and size are required'}), 400
+    if size > UPLOAD_MAX_MB * 1024 * 1024:
+        return jsonify({'error': f'Uploads are limited to {UPLOAD_MAX_MB:g} MB'}), 413
+    exercise = data.get('exercise') or 'pushup'
+    if not isinstance(exercise, str) or exercise.strip().lower() not in EXERCISES:
+        return jsonify({'error': f'Unknown exercise: {exercise}'}), 400
+    exercise = exercise.strip().lower()
+
+    sweep_uploads()
+    upload_id = uuid.uuid4().hex
+    path = os.path.join(app.config['UPLOAD_FOLDER'], f"{upload_id}_{filename}")
+    open(path + '.part', 'wb').close()
+    upload = {
+        'id': upload_id,
+        'user_id': session['user_id'],
+        'path': path,
+        'size': size,
+        'exercise': exercise,
+        'options': analysis_options(data),
+        'session_id': None,
+        'updated_at': time.time(),
+    }
+    get_db().execute(f"INSERT INTO uploads ({', '.join(upload)}) VALUES ({', '.join('?' * len(upload))})",
+                     [json.dumps(value) if name == 'options' else value for name, value in upload.items()])
+    upload['received'] = 0
+    status = upload_status(upload_id, upload)
+    status.update(upload_url=url_for('upload_chunk', upload_id=upload_id), chunk_size=UPLOAD_CHUNK_BYTES)
+    return jsonify(status), 201
+
+
+@app.route('/upload/<upload_id>', methods=['GET'])
+def upload_state(upload_id):
+    """How much of an upload the server has, so an interrupted client can resume from there"""
+    upload = get_upload(upload_id)
+    if upload is None:
+        return jsonify({'error': 'Upload not found'}), 404
+    return jsonify(upload_status(upload_id, upload))
+
+
+@app.route('/upload/<upload_id>', methods=['PUT'])
+def upload_chunk(upload_id):
+    """Append a chunk (``Content-Range: bytes start-end/size``) to an upload, streaming it to disk.
+
+    Analysis starts as soon as the received prefix can be decoded, which for
+    MP4/MOV with the index at the front is after the first chunk; otherwise
+    when the last chunk arrives.
+    """
+    upload = get_upload(upload_id)
+    if upload is None:
+        return jsonify({'error': 'Upload not found'}), 404
+    try:
+        unit, _, spec = request.headers['Content-Range'].partition(' ')
+        span, _, total = spec.partition('/')
+        start = int(span.split('-')[0])
+        if unit != 'bytes' or int(total) != upload['size']:
+            raise ValueError
+    except (KeyError, ValueError):
+        return jsonify({'error': 'Content-Range: bytes start-end/size is required'}), 400
+
+    if upload['received'] >= upload['size']:
+        return jsonify(dict(upload_status(upload_id, upload), error='Upload is already complete')), 409
+    lock = lock_upload(upload)
+    if lock is None:
+        return jsonify({'error': 'Another chunk is being written'}), 409
+    try:
+        upload['received'] = upload_received(upload)  # another worker may have written a chunk meanwhile
+        if start != upload['received'] or start >= upload['size']:
+            return jsonify(dict(upload_status(upload_id, upload), error='Chunk does not start at the received offset')), 409
+        part_path = upload['path'] + '.part'
+        with open(part_path, 'ab') as f:
+            while upload['received'] < upload['size']:
+                block = request.stream.read(min(1024 * 1024, upload['size'] - upload['received']))
+                if not block:
+                    break
+                f.write(block)
+                f.flush()
+                upload['received'] += len(block)
+        get_db().execute('UPDATE uploads SET updated_at = ? WHERE id = ?', (time.time(), upload_id))
+        if upload['received'] >= upload['size']:
+            os.replace(part_path, upload['path'])
+            if lock is not _upload_lock:
+                os.remove(upload['path'] + '.lock')  # later chunks are refused: the upload is complete
+            start_upload_analysis(upload)
+        elif not upload['session_id'] and streamable_prefix(mp4_boxes(part_path, upload['received']), upload['received']):
+            start_upload_analysis(upload)
+    finally:
+        unlock_upload(lock)
+    return jsonify(upload_status(upload_id, upload))
+
+
+@app.route('/live', methods=['GET'])
+def live_page():
+    """Live camera rep counting"""
+    if 'user_id' not in session:
+        return redirect(url_for('index'))
+    return render_template('live.html', exercises={name: rule['name'] for name, rule in EXERCISES.items()},
+                           latency_budget_ms=LIVE_LATENCY_BUDGET_MS)
+
+
+@app.route('/live/start', methods=['POST'])
+def live_start():
+    """Open a live camera session; frames are then posted to /live/<id>/frame"""
+    if 'user_id' not in session:
+        return jsonify({'error': 'Not authenticated'}), 401
+    if not MEDIAPIPE_AVAILABLE:
+        return jsonify({'error': 'Live analysis needs MediaPipe'}), 503
+
+    data = request.get_json(silent=True) or {}
+    if not isinstance(data, dict):
+        return jsonify({'error': 'Expected a JSON object'}), 400
+    exercise = data.get('exercise') or 'pushup'
+    if not isinstance(exercise, str) or exercise.strip().lower() not in EXERCISES:
+        return jsonify({'error': f'Unknown exercise: {exercise}'}), 400
+    exercise = exercise.strip().lower()
+
+    session_id = str(uuid.uuid4())
+    options = {'inference_size': parse_inference_size(data.get('inference_size')), 'live': True}
+    live_session = create_analysis_session(None, exercise, session['user_id'], options)
+    live_session['live'] = {'seq': 0, 'done_seq': 0, 'pending': None, 'result': None, 'dropped': 0, 'stop': False}
+    live_session['job'] = threading.Thread(target=run_live_worker, args=(session_id,),
+                                           name=f'live-{session_id[:8]}', daemon=True)
+    sessions[session_id] = live_session
+    live_session['job'].start()
+
+    return jsonify({
+        'session_id': session_id,
+        'exercise': exercise,
+        'frame_url': url_for('live_frame', session_id=session_id),
+        'stop_url': url_for('live_stop', session_id=session_id),
+        'events_url': url_for('events', session_id=session_id),
+        'download_url': url_for('download_csv', session_id=session_id),
+        'latency_budget_ms': LIVE_LATENCY_BUDGET_MS,
+    })
+
+
+def get_live_session(session_id: str):
+    live_session = sessions.get(session_id)
+    if not live_session or 'live' not in live_session or live_session.get('user_id') != session.get('user_id'):
+        return None
+    return live_session
+
+
+@app.route('/live/<session_id>/frame', methods=['POST'])
+def live_frame(session_id):
+    """Post one JPEG camera frame (raw body); returns its metrics and landmarks, or that it was dropped"""
+    live_session = get_live_session(session_id)
+    if live_session is None:
+        return jsonify({'error': 'Session not found'}), 404
+    if live_session.get('is_done'):
+        return jsonify({'error': 'Session finished'}), 409
+    jpeg = request.get_data(cache=False)
+    if not jpeg:
+        return jsonify({'error': 'Empty frame'}), 400
+    try:
+        client_ts = float(request.headers['X-Timestamp-Ms'])
+    except (KeyError, ValueError):
+        client_ts = None
+    return jsonify(submit_live_frame(live_session, jpeg, client_ts))
+
+
+@app.route('/live/<session_id>/stop', methods=['POST'])
+def live_stop(session_id):
+    live_session = get_live_session(session_id)
+    if live_session is None:
+        return jsonify({'error': 'Session not found'}), 404
+    cond = live_session['frame_cond']
+    with cond:
+        live_session['live']['stop'] = True
+        cond.notify_all()
+    live_session['job'].join(timeout=10)
+    return jsonify({
+        'session_id': session_id,
+        'dropped_frames': live_session['live']['dropped'],
+        'summary': live_session['summary'].summary(),
+    })
+
+
 @app.route('/view/<session_id>', methods=['GET'])
 def view_analysis(session_id):
     if session_id not in sessions:
@@ -828,7 +3968,7 @@ def view_analysis(session_id):
 @app.route('/history', methods=['GET'])
 def history():
     # Return latest 50 sessions, newest first
-    items = sorted(session_history, key=lambda x: x.get('created_at', 0), reverse=True)[:50]
+    items = get_recent_sessions(50)
     return render_template('history.html', sessions=items)
 
 
@@ -837,7 +3977,83 @@ def stream(session_id):
     if session_id not in sessions:
         return Response(status=404)
 
-    return Response(analyze_video_generator(session_id), mimetype='multipart/x-mixed-replace; boundary=frame')
+    start_analysis_job(session_id)
+    quality, width = parse_stream_settings(request.args)
+    return Response(stream_session_frames(session_id, quality, width),
+                    mimetype='multipart/x-mixed-replace; boundary=frame')
+
+
+def metrics_payload(session: dict, summary: bool = True) -> dict:
+    """Live metrics of a session as served by /metrics and /events"""
+    payload = {
+        'count': session['current_metrics'].get('count', 0),
+        'feedback': session['current_metrics'].get('feedback', ''),
+        'elbow_angle': session['current_metrics'].get('elbow_angle', 0),
+        'hip_angle': session['current_metrics'].get('hip_angle', 0),
+        'is_done': session.get('is_done', False),
+    }
+    if summary:
+        payload['summary'] = session['summary'].summary(rep_durations=False) if session.get('summary') else None
+    return payload
+
+
+# Idle seconds after which an event stream sends a comment to keep proxies from closing it.
+EVENTS_KEEPALIVE_S = 15.0
+
+
+def stream_session_events(session_id: str, rate: float = 0.0, summary: bool = False):
+    """Server-Sent Events: push a ``metrics`` event whenever the live metrics change.
+
+    With ``rate`` set, at most that many events are sent per second and only
+    the latest metrics are sent after a pause. Ends with a ``done`` event.
+    """
+    session = sessions.get(session_id)
+    if not session:
+        return
+    cond = session['frame_cond']
+    min_interval = 1.0 / rate if rate > 0 else 0.0
+    last_seq = None
+    last_sent = 0.0
+    yield 'retry: 2000\n\n'
+    while True:
+        with cond:
+            changed = cond.wait_for(
+                lambda: session.get('metrics_seq', 0) != last_seq or session.get('is_done'),
+                timeout=EVENTS_KEEPALIVE_S)
+            seq = session.get('metrics_seq', 0)
+            done = session.get('is_done', False)
+        if done:
+            yield f"event: done\ndata: {json.dumps(metrics_payload(session, summary=True))}\n\n"
+            return
+        if not changed:
+            yield ': keep-alive\n\n'
+            continue
+        wait = last_sent + min_interval - time.monotonic()
+        if wait > 0:
+            # coalesce: whatever changes meanwhile goes out as one event
+            time.sleep(wait)
+            continue
+        last_seq = seq
+        last_sent = time.monotonic()
+        yield f"event: metrics\nid: {seq}\ndata: {json.dumps(metrics_payload(session, summary))}\n\n"
+
+
+@app.route('/video/<session_id>')
+def replay_video(session_id):
+    """Annotated replay as a seekable video file (Range requests and ETags via send_file)"""
+    session = sessions.get(session_id)
+    if not session:
+        return Response(status=404)
+    if session.get('video_state') == 'ready':
+        path = session['video_export']
+        return send_file(os.path.abspath(path), mimetype=VIDEO_MIMETYPES.get(path.rsplit('.', 1)[1]),
+                         conditional=True, etag=True, max_age=3600)
+    if (session.get('video_state') == 'failed' or not session.get('video_path')
+            or (session.get('is_done') and not replayable(session))):
+        return jsonify({'status': 'unavailable'}), 404
+    if session.get('is_done'):
+        start_video_render(session_id)
+    return jsonify({'status': 'rendering'}), 202, {'Retry-After': '2'}
 
 
 @app.route('/metrics/<session_id>')
@@ -845,13 +4061,21 @@ def metrics(session_id):
     session = sessions.get(session_id)
     if not session:
         return jsonify({}), 404
-    return jsonify({
-        'count': session['current_metrics'].get('count', 0),
-        'feedback': session['current_metrics'].get('feedback', ''),
-        'elbow_angle': session['current_metrics'].get('elbow_angle', 0),
-        'hip_angle': session['current_metrics'].get('hip_angle', 0),
-        'is_done': session.get('is_done', False)
-    })
+    return jsonify(metrics_payload(session))
+
+
+@app.route('/events/<session_id>')
+def events(session_id):
+    """Live metrics as Server-Sent Events (``?rate=`` caps updates per second, ``?summary=1`` adds the summary)"""
+    if session_id not in sessions:
+        return Response(status=404)
+    try:
+        rate = max(0.0, float(request.args.get('rate', 0)))
+    except ValueError:
+        rate = 0.0
+    summary = request.args.get('summary') == '1'
+    return Response(stream_session_events(session_id, rate, summary), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
 
 
 @app.route('/download/<session_id>')
@@ -860,9 +4084,62 @@ def download_csv(session_id):
     if not session:
         return Response(status=404)
     csv_path = session.get('csv_path')
+    npz_path = session.get('npz_path')
+    if csv_path and not os.path.exists(csv_path) and npz_path and os.path.exists(npz_path):
+        # scored in one pass (or the CSV was cleaned up): produce it from the binary store
+        SessionRecords.from_npz(npz_path).write_csv(csv_path)
     if not csv_path or not os.path.exists(csv_path):
         return Response("CSV not ready yet", status=404)
-    return send_file(csv_path, as_attachment=True, download_name=f'{session_id}.csv')
+    # while the session runs this is the part written so far
+    return send_file(os.path.abspath(csv_path), as_attachment=True, download_name=f'{session_id}.csv',
+                     max_age=0)
+
+
+@app.route('/export/<session_id>.npz')
+def export_npz(session_id):
+    """Columnar binary export of a finished session's records"""
+    session = sessions.get(session_id)
+    if not session:
+        return Response(status=404)
+    npz_path = session.get('npz_path')
+    if not npz_path or not os.path.exists(npz_path):
+        return Response("Export not ready yet", status=404)
+    return send_file(os.path.abspath(npz_path), as_attachment=True, download_name=f'{session_id}.npz',
+                     mimetype='application/octet-stream')
+
+
+@app.route('/rescore/<session_id>', methods=['POST'])
+def rescore(session_id):
+    """Re-score a finished session's stored landmarks with another exercise or thresholds"""
+    session = sessions.get(session_id)
+    if not session:
+        return jsonify({'error': 'Session not found'}), 404
+    landmarks = session.get('landmarks')
+    if not session.get('is_done') or landmarks is None:
+        return jsonify({'error': 'Session has no stored landmarks yet'}), 409
+
+    data = request.get_json(silent=True) or {}
+    if not isinstance(data, dict):
+        return jsonify({'error': 'Expected a JSON object'}), 400
+    exercise = data.get('exercise') or session.get('exercise', 'pushup')
+    if not isinstance(exercise, str):
+        return jsonify({'error': 'Exercise must be a string'}), 400
+    exercise = exercise.strip().lower()
+    if exercise not in EXERCISES:
+        return jsonify({'error': f'Unknown exercise: {exercise}'}), 400
+    thresholds = data.get('thresholds') or {}
+    params = EXERCISES[exercise]['params']
+    try:
+        overrides = {name: float(value) for name, value in thresholds.items() if name in params}
+    except (TypeError, ValueError, AttributeError):
+        return jsonify({'error': 'Thresholds must be numbers'}), 400
+
+    records = analyze_landmark_series(exercise, landmarks, overrides)
+    return jsonify({
+        'exercise': exercise,
+        'thresholds': dict(params, **overrides),
+        'summary': aggregate_session_summary(records),
+    })
 
 
 @app.route('/qa')
@@ -893,8 +4170,6 @@ def ask_question():
         if not question_text:
             return jsonify({'success': False, 'message': 'Question cannot be empty'})
         
-        questions = load_questions()
-        
         new_question = {
             'id': str(uuid.uuid4()),
             'question': question_text,
@@ -907,8 +4182,7 @@ def ask_question():
             'status': 'open'
         }
         
-        questions.append(new_question)
-        save_questions(questions)
+        add_question(new_question)
         
         return jsonify({'success': True, 'message': 'Question posted successfully'})
         
@@ -933,16 +4207,7 @@ def answer_question():
         if not question_id or not answer_text:
             return jsonify({'success': False, 'message': 'Question ID and answer are required'})
         
-        questions = load_questions()
-        
-        # Find the question
-        question = None
-        for q in questions:
-            if q['id'] == question_id:
-                question = q
-                break
-        
-        if not question:
+        if question_store.get(question_id) is None:
             return jsonify({'success': False, 'message': 'Question not found'})
         
         new_answer = {
@@ -954,10 +4219,7 @@ def answer_question():
             'created_at': datetime.now().isoformat()
         }
         
-        question['answers'].append(new_answer)
-        question['status'] = 'answered'
-        
-        save_questions(questions)
+        add_answer(question_id, new_answer)
         
         return jsonify({'success': True, 'message': 'Answer posted successfully'})
         
@@ -981,17 +4243,11 @@ def insights(session_id):
     except Exception:
         user_prompt = ''
 
-    records = session.get('records', [])
-    summary = aggregate_session_summary(records)
+    running = session.get('summary')
+    summary = running.summary() if running else aggregate_session_summary(session.get('records', []))
 
     ex = session.get('exercise', 'pushup')
-    ex_name = {
-        'pushup': 'push-up',
-        'pullup': 'pull-up',
-        'situp': 'sit-up',
-        'jumping_jack': 'jumping jack',
-        'plank': 'plank',
-    }.get(ex, ex)
+    ex_name = EXERCISES[ex]['name'] if ex in EXERCISES else ex
     base_instruction = (
         f"You are a certified strength coach. Analyze this {ex_name} session and provide: "
         "1) brief form assessment, 2) top improvement priorities, 3) best exercises and progressions "
@@ -1003,8 +4259,10 @@ def insights(session_id):
         f"Duration (s): {round(summary['duration_ms']/1000.0, 2)}\n"
         f"Avg elbow angle: {round(summary['avg_elbow_angle'],1)}\n"
         f"Avg hip angle: {round(summary['avg_hip_angle'],1)}\n"
-        f"Min/Max elbow: {round(summary['min_elbow_angle'],1)}/{round(summary['max_elbow_angle'],1)}\n"
-        f"Min/Max hip: {round(summary['min_hip_angle'],1)}/{round(summary['max_hip_angle'],1)}\n"
+        f"Min/Max elbow: {round(summary['min_elbow_angle'] or 0.0,1)}/{round(summary['max_elbow_angle'] or 0.0,1)}\n"
+        f"Min/Max hip: {round(summary['min_hip_angle'] or 0.0,1)}/{round(summary['max_hip_angle'] or 0.0,1)}\n"
+        f"Elbow/hip angle std dev: {round(summary['std_elbow_angle'],1)}/{round(summary['std_hip_angle'],1)}\n"
+        f"Avg/fastest rep time (s): {round(summary['avg_rep_s'],2)}/{round(summary['fastest_rep_s'] or 0.0,2)}\n"
         f"Hip warning frames: {summary['hip_warning_frames']}\n"
         f"Go lower frames: {summary['go_lower_frames']}\n"
         f"Good form frames: {summary['good_form_frames']}\n"
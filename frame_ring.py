@@ -0,0 +1,102 @@
+"""
+Frame capture helpers shared with the decode process.
+
+``SharedMemoryCapture`` starts ``decode_into_ring`` in a spawned process,
+which imports this module rather than app.py, so a session's decoder does
+not load Flask, MediaPipe or the user database.
+"""
+
+import queue
+from multiprocessing import shared_memory
+
+import cv2
+import numpy as np
+
+
+class FrameRangeCapture:
+    """A ``cv2.VideoCapture`` restricted to frames ``[start, stop)``; ``stop=None`` reads to the end"""
+
+    def __init__(self, cap, start: int, stop: int | None = None):
+        self.cap = cap
+        self.stop = stop
+        if start:
+            cap.set(cv2.CAP_PROP_POS_FRAMES, start)
+
+    def _in_range(self) -> bool:
+        return self.stop is None or self.cap.get(cv2.CAP_PROP_POS_FRAMES) < self.stop
+
+    def isOpened(self):
+        return self.cap.isOpened() and self._in_range()
+
+    def grab(self):
+        return self._in_range() and self.cap.grab()
+
+    def read(self):
+        if not self._in_range():
+            return False, None
+        return self.cap.read()
+
+    def get(self, prop):
+        return self.cap.get(prop)
+
+    def release(self):
+        self.cap.release()
+
+
+class SharedFrameRing:
+    """Fixed-size BGR frame slots in one ``multiprocessing.shared_memory`` block.
+
+    Only slot indices travel between processes: the producer takes a slot
+    from ``free``, writes a frame into it and puts ``(slot, frame_index,
+    timestamp_ms)`` on ``ready``; the consumer hands the slot back to
+    ``free`` once it is done with the frame. Memory is ``slots`` frames,
+    however long the video.
+    """
+
+    def __init__(self, slots: int, shape: tuple, name: str | None = None):
+        self.slots = slots
+        self.shape = tuple(shape)
+        size = slots * int(np.prod(self.shape))
+        if name is None:
+            self.shm = shared_memory.SharedMemory(create=True, size=size)
+        else:
+            self.shm = shared_memory.SharedMemory(name=name)
+        self.frames = np.ndarray((slots,) + self.shape, dtype=np.uint8, buffer=self.shm.buf)
+
+    @property
+    def name(self) -> str:
+        return self.shm.name
+
+    def close(self, unlink: bool = False):
+        self.frames = None
+        self.shm.close()
+        if unlink:
+            self.shm.unlink()
+
+
+def decode_into_ring(video_path: str, start: int, stop: int | None, ring_name: str, slots: int,
+                     shape: tuple, free, ready, stop_event):
+    """Decode process: fill ring slots with frames ``[start, stop)`` until the video ends"""
+    ring = SharedFrameRing(slots, shape, ring_name)
+    cap = FrameRangeCapture(cv2.VideoCapture(video_path), start, stop)
+    try:
+        while cap.isOpened() and not stop_event.is_set():
+            ret, frame = cap.read()
+            if not ret:
+                break
+            slot = None
+            while slot is None and not stop_event.is_set():
+                try:
+                    slot = free.get(timeout=0.1)
+                except queue.Empty:
+                    continue
+            if slot is None:
+                break
+            if frame.shape != shape:
+                frame = cv2.resize(frame, (shape[1], shape[0]), interpolation=cv2.INTER_AREA)
+            ring.frames[slot] = frame
+            ready.put((slot, int(cap.get(cv2.CAP_PROP_POS_FRAMES)), cap.get(cv2.CAP_PROP_POS_MSEC)))
+    finally:
+        cap.release()
+        ready.put(None)
+        ring.close()
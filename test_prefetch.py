@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+"""
+Checks that sampled analysis only decodes the frames it runs pose inference on
+"""
+
+import types
+
+import cv2
+import numpy as np
+
+import app
+
+
+class CountingCapture:
+    """In-memory stand-in for cv2.VideoCapture that counts decodes and grabs"""
+
+    def __init__(self, frames=300, fps=30.0):
+        self.frames = frames
+        self.fps = fps
+        self.position = 0
+        self.decoded = 0
+        self.grabbed = 0
+
+    def isOpened(self):
+        return self.position < self.frames
+
+    def grab(self):
+        if self.position >= self.frames:
+            return False
+        self.position += 1
+        self.grabbed += 1
+        return True
+
+    def read(self):
+        if self.position >= self.frames:
+            return False, None
+        self.position += 1
+        self.decoded += 1
+        return True, np.full((48, 64, 3), self.position % 256, dtype=np.uint8)
+
+    def get(self, prop):
+        if prop == cv2.CAP_PROP_POS_FRAMES:
+            return float(self.position)
+        if prop == cv2.CAP_PROP_POS_MSEC:
+            return self.position * 1000.0 / self.fps
+        if prop == cv2.CAP_PROP_FPS:
+            return self.fps
+        if prop == cv2.CAP_PROP_FRAME_COUNT:
+            return float(self.frames)
+        return 0.0
+
+
+class CountingPose:
+    """Pose model that always finds the same upright pose"""
+
+    def __init__(self):
+        self.calls = 0
+
+    def process(self, image):
+        self.calls += 1
+        landmark = [types.SimpleNamespace(x=0.5, y=0.2 + 0.02 * (i % 30), z=0.0, visibility=0.9) for i in range(33)]
+        return types.SimpleNamespace(pose_landmarks=types.SimpleNamespace(landmark=landmark))
+
+
+def run_sampled(sample_rate, depth):
+    cap = CountingCapture()
+    pose = CountingPose()
+    prefetch = app.PrefetchCapture(cap, depth, sampled=True) if depth else None
+    options = {'sample_rate': sample_rate, 'inference_size': 0}
+    try:
+        records = list(app._infer_pose_frames(prefetch or cap, 'pushup', pose, options, None, lambda: False))
+    finally:
+        if prefetch is not None:
+            prefetch.close()
+    return cap, pose, records
+
+
+def test_prefetch_decodes_only_samples():
+    for sample_rate in (5, 15):
+        inline_cap, inline_pose, inline_records = run_sampled(sample_rate, 0)
+        cap, pose, records = run_sampled(sample_rate, 4)
+        assert cap.decoded == pose.calls == inline_cap.decoded
+        assert cap.grabbed > 0 and cap.decoded + cap.grabbed == cap.frames
+        assert [r[0] for r in records] == [r[0] for r in inline_records]
+
+
+def test_prefetch_without_sampling_decodes_every_frame():
+    cap = CountingCapture(frames=40)
+    prefetch = app.PrefetchCapture(cap, 4)
+    try:
+        while prefetch.read()[0]:
+            pass
+    finally:
+        prefetch.close()
+    assert cap.decoded == 40 and cap.grabbed == 0